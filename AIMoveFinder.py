@@ -1,99 +1,559 @@
 import random
-from Constants import Color, Piece
+import time
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import ChessEngine
+from Constants import Color, Piece, Bound, MoveFlag
+from TranspositionTable import TranspositionTable
+from MoveOrdering import MoveOrderer, MAX_PLY
+from SearchStats import SearchProfiler
+from Tablebase import Tablebase, MAX_PIECES, MAX_TABLE_PLIES
+from Bitboards import popcount
+import Evaluation
 
 piece_score = {Piece.KING: 0, Piece.PAWN : 1, Piece.ROOK: 5, Piece.KNIGHT: 3, Piece.BISHOP: 3, Piece.QUEEN : 10}
-CHECKMATE = 1000
+CHECKMATE = 100000
 STALEMATE = 0
+# Scores beyond this are mates; they are stored in the table relative to the
+# node rather than the root so they stay valid wherever the position recurs.
+# Tablebase mates can lie up to MAX_TABLE_PLIES beyond the search horizon.
+MATE_THRESHOLD = CHECKMATE - MAX_PLY - MAX_TABLE_PLIES
+# Delta pruning margin: a capture is skipped in quiescence when even winning the
+# captured piece plus this much cannot lift the score up to alpha
+DELTA_MARGIN = 200
+# Plies searched when find_best_move is given neither a time nor a node budget
+DEFAULT_DEPTH = 2
+# The clock and node budget are checked every (LIMIT_CHECK_INTERVAL + 1) nodes
+LIMIT_CHECK_INTERVAL = 255
+
+
+class SearchAborted(Exception):
+    pass
+
+
+class SearchHandle:
+    # A search running in a background thread, as returned by AIMoveFinder.start_search
+    def __init__(self, finder):
+        self.finder = finder
+        self.thread = None
+        self.best_move = None
+        self.cancelled = False
+        self.start_time = time.perf_counter()
+        # Set for ponder searches: the expected reply the search assumes was played
+        self.ponder_move = None
+        # Stops a ponder search once it has been turned into a timed one
+        self.timer = None
+
+    def done(self):
+        return not self.thread.is_alive()
+
+    def result(self):
+        # Waits for the search and returns its best move (None if cancelled)
+        self.thread.join()
+        if self.timer is not None:
+            self.timer.cancel()
+        return None if self.cancelled else self.best_move
+
+    def cancel(self):
+        # Stops the search and waits for it to unwind, which takes a few milliseconds
+        self.cancelled = True
+        if self.timer is not None:
+            self.timer.cancel()
+        self.finder.stop()
+        self.thread.join()
+
+    @property
+    def info(self):
+        # Live depth/score/nodes of the last completed iteration
+        return self.finder.search_info
+
 
 class AIMoveFinder:
-    def __init__(self):
-        pass
+    def __init__(self, tt_size_mb=16, workers=1, profile=False, book=None, tablebase=None, rng=random):
+        self.tt_size_mb = tt_size_mb
+        self.tt = TranspositionTable(tt_size_mb)
+        self.orderer = MoveOrderer(piece_score)
+        self.nodes = 0
+        # Quiescence nodes, also counted in nodes
+        self.qnodes = 0
+        self.deadline = None
+        self.max_nodes = None
+        self.completed_depth = 0
+        self.stop_requested = False
+        self.search_info = {}
+        # Nodes searched by each finished iteration, for the branching factor
+        self.iteration_nodes = []
+        self.tt_probes_at_start = (0, 0)
+        # TT hits and misses of the worker processes, which do the probing in a parallel search
+        self.worker_tt_probes = [0, 0]
+        # Callbacks called as listener(event, search_info) after every iteration
+        # ("iteration") and once the search ends ("done")
+        self.listeners = []
+        # Adds a movegen/eval/make_undo time split to search_info,
+        # see SearchProfiler; serial search only
+        self.profile = profile
+        # OpeningBook consulted before searching; a book move is played without search
+        self.book = book
+        # Picks book and random moves; pass a seeded random.Random for repeatable games
+        self.rng = rng
+        # Tablebase probed at the root and at every node with few enough pieces
+        self.tablebase = tablebase
+        # With more than one worker, root moves are searched in a process pool
+        self.workers = workers
+        self.executor = None
+        self.stop_event = None
 
     def find_random_move(self, valid_moves):
-        return random.choice(valid_moves)
+        return self.rng.choice(valid_moves)
 
-    def find_best_move(self, gs, valid_moves):
-        best_move = None
-        # better_move_flag = 0
+    def find_best_move(self, gs, valid_moves, time_limit_ms=None, max_nodes=None, max_depth=None):
+        # Iterative deepening: search depth 1, 2, ... until a budget runs out and
+        # return the best move of the deepest iteration that finished
+        if not valid_moves:
+            # nothing to search, but search_info must not go on showing the last search
+            self.reset_search_info()
+            self.update_search_info(time.perf_counter())
+            return None
+        if self.book is not None:
+            book_move = self.book.choose_move(gs, self.rng)
+            if book_move is not None:
+                self.reset_search_info()
+                self.search_info.update(best_move=book_move, book=True)
+                self.update_search_info(time.perf_counter())
+                return book_move
+        if self.tablebase is not None:
+            tablebase_move = self.tablebase.best_move(gs)
+            if tablebase_move is not None:
+                self.reset_search_info()
+                self.search_info.update(best_move=tablebase_move, tablebase=True)
+                self.update_search_info(time.perf_counter())
+                return tablebase_move
+        if self.workers > 1:
+            return self.find_best_move_parallel(gs, valid_moves, time_limit_ms, max_nodes, max_depth)
+        if max_depth is None:
+            max_depth = MAX_PLY if time_limit_ms or max_nodes else DEFAULT_DEPTH
 
-        if gs.color == Color.WHITE:
-            best_score = -float('inf')
-        else:
-            best_score = float('inf')
+        start_time = time.perf_counter()
+        self.deadline = start_time + time_limit_ms / 1000 if time_limit_ms else None
+        self.max_nodes = max_nodes
+        self.nodes = 0
+        self.completed_depth = 0
+        self.reset_search_info()
+        self.orderer.new_search()
+        profiler = None
+        if self.profile:
+            profiler = SearchProfiler()
+            profiler.install(self, gs)
+
+        root_ply = len(gs.move_log)
+        root_entry = self.tt.probe(gs.zobrist_key)
+        root_moves = self.orderer.order_moves(gs, list(valid_moves), 0, root_entry[3] if root_entry else None)
+        best_move = root_moves[0]
+        try:
+            for depth in range(1, max_depth + 1):
+                try:
+                    move, score = self.search_root(gs, root_moves, depth)
+                except SearchAborted:
+                    # unwind the moves the aborted search left on the board
+                    while len(gs.move_log) > root_ply:
+                        gs.undo_move()
+                    break
+
+                best_move = move
+                self.completed_depth = depth
+                # the previous best move is searched first in the next iteration
+                root_moves.remove(move)
+                root_moves.insert(0, move)
+
+                self.update_search_info(start_time, depth=depth, score=score, best_move=move)
+                if abs(score) > MATE_THRESHOLD:
+                    break
+        finally:
+            if profiler is not None:
+                profiler.uninstall()
+                self.search_info.update(profiler.stats())
+            self.clear_stop()
+
+        self.update_search_info(start_time)
+        return best_move
+
+    def reset_search_info(self):
+        self.nodes = 0
+        self.qnodes = 0
+        self.orderer.reset_stats()
+        self.search_info = {"depth": 0, "score": None, "best_move": None, "nodes": 0, "time_ms": 0, "nps": 0}
+        self.iteration_nodes = []
+        self.tt_probes_at_start = (self.tt.hits, self.tt.misses)
+        self.worker_tt_probes = [0, 0]
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
 
-        for move in valid_moves:
+    def remove_listener(self, listener):
+        self.listeners.remove(listener)
+
+    def update_search_info(self, start_time, **fields):
+        # Called with the depth/score/best_move of every finished iteration and
+        # once more without fields when the search ends
+        elapsed = time.perf_counter() - start_time
+        if fields:
+            self.iteration_nodes.append(self.nodes - sum(self.iteration_nodes))
+        hits = self.tt.hits - self.tt_probes_at_start[0] + self.worker_tt_probes[0]
+        probes = hits + self.tt.misses - self.tt_probes_at_start[1] + self.worker_tt_probes[1]
+        self.search_info.update(fields)
+        self.search_info.update(nodes=self.nodes, qnodes=self.qnodes, time_ms=int(elapsed * 1000),
+                                nps=int(self.nodes / elapsed) if elapsed else 0,
+                                cutoffs=self.orderer.cutoffs,
+                                first_move_cutoff_rate=self.orderer.first_move_cutoff_rate(),
+                                tt_hit_rate=hits / probes if probes else 0.0,
+                                branching_factor=(self.iteration_nodes[-1] / self.iteration_nodes[-2]
+                                                  if len(self.iteration_nodes) > 1 and self.iteration_nodes[-2] else None))
+        for listener in self.listeners:
+            listener("iteration" if fields else "done", dict(self.search_info))
+
+    def search_root(self, gs, root_moves, depth):
+        best_move = None
+        best_score = -float('inf')
+        alpha, beta = -float('inf'), float('inf')
+
+        for move in root_moves:
             gs.make_move(move)
-            is_maximizing = (gs.color == Color.WHITE)
-            score = self.minimax(gs, is_maximizing, depth=1, alpha = -float('inf'), beta = float('inf'))
+            score = -self.negamax(gs, depth - 1, -beta, -alpha, ply=1)
             gs.undo_move()
 
-            if gs.color == Color.WHITE:
-                if score > best_score:
-                    best_score = score
-                    best_move = move
-                    better_move_flag +=1
-            else:
-                if score < best_score:
-                    best_score = score
-                    best_move = move
-                    # better_move_flag += 1
-        
-        # if better_move_flag < 2:
-        #     best_move = random.choice(valid_moves)
+            if score > best_score:
+                best_score = score
+                best_move = move
+            alpha = max(alpha, score)
+
+        return best_move, best_score
+
+    def start_search(self, gs, time_limit_ms=None, max_nodes=None, max_depth=None):
+        # Runs find_best_move in a background thread on a copy of gs, so the
+        # caller keeps control and may read handle.info or cancel the search
+        board = ChessEngine.ChessBoard.from_snapshot(gs.snapshot())
+        handle = SearchHandle(self)
+
+        def run():
+            handle.best_move = self.find_best_move(board, board.get_valid_moves(), time_limit_ms, max_nodes, max_depth)
+
+        # cleared here rather than in the thread, where a stop() sent right
+        # after start_search could be wiped out before the search saw it
+        self.clear_stop()
+        handle.thread = threading.Thread(target=run, daemon=True)
+        handle.thread.start()
+        return handle
+
+    def start_ponder(self, gs):
+        # Searches on the opponent's time. The expected reply (the hash move of
+        # gs) is played on a copy of the board and the position after it searched
+        # without limits. With no expected reply gs itself is searched, which
+        # fills the table for all of the opponent's replies.
+        board = ChessEngine.ChessBoard.from_snapshot(gs.snapshot())
+        entry = self.tt.probe(board.zobrist_key)
+        ponder_move = None
+        if entry is not None:
+            ponder_move = entry[3] if entry[3] in board.get_valid_moves() else None
+        if ponder_move is not None:
+            board.make_move(ponder_move)
+
+        handle = self.start_search(board, max_depth=MAX_PLY)
+        handle.ponder_move = ponder_move
+        return handle
+
+    def ponder_hit(self, handle, time_limit_ms):
+        # The opponent played the expected reply: the ponder search goes on as the
+        # real one, keeping its table entries and completed depth. Time spent
+        # pondering counts towards the budget, so the reply is often instant.
+        remaining = time_limit_ms / 1000 - (time.perf_counter() - handle.start_time)
+        if remaining <= 0:
+            # the search never clears the flag itself (see start_search), so
+            # this stop holds even if the ponder thread has barely started
+            self.stop()
+        else:
+            handle.timer = threading.Timer(remaining, self.stop)
+            handle.timer.daemon = True
+            handle.timer.start()
+        return handle
+
+    def find_best_move_parallel(self, gs, valid_moves, time_limit_ms=None, max_nodes=None, max_depth=None):
+        # Root-parallel iterative deepening: every iteration hands each root move
+        # to the worker pool as a separate task, then reorders the root moves by
+        # the scores they came back with
+        if not valid_moves:
+            return None
+        if max_depth is None:
+            max_depth = MAX_PLY if time_limit_ms or max_nodes else DEFAULT_DEPTH
+
+        executor = self.get_executor()
+        if self.stop_requested:
+            # stopped before the event existed
+            self.stop_event.set()
+        start_time = time.perf_counter()
+        # workers convert the wall-clock deadline to their own clocks
+        deadline = time.time() + time_limit_ms / 1000 if time_limit_ms else None
+        self.nodes = 0
+        self.completed_depth = 0
+        self.reset_search_info()
+        self.orderer.new_search()
+
+        state = gs.pack()
+        # packed positions carry no history, so workers get the keys that can repeat alongside
+        recent_keys = gs.get_recent_keys()
+        root_moves = self.orderer.order_moves(gs, list(valid_moves), 0)
+        best_move = root_moves[0]
+        for depth in range(1, max_depth + 1):
+            task_nodes = None
+            if max_nodes is not None:
+                task_nodes = (max_nodes - self.nodes) // len(root_moves)
+                if task_nodes <= 0:
+                    break
+            # The first (expected best) move is searched alone with a full window;
+            # its score then lets all other moves be refuted in parallel cheaply
+            first_result = executor.submit(_search_root_move, state, recent_keys, root_moves[0], depth, -float('inf'),
+                                           deadline, task_nodes).result()
+            results = [first_result]
+            if first_result is not None:
+                futures = [executor.submit(_search_root_move, state, recent_keys, move, depth, first_result[0],
+                                           deadline, task_nodes) for move in root_moves[1:]]
+                results += [future.result() for future in futures]
+            for result in results:
+                if result is not None:
+                    self.add_worker_stats(*result[1:])
+            if None in results or self.stop_requested:
+                break
+
+            scored_moves = sorted(zip(results, root_moves), key=lambda scored_move: -scored_move[0][0])
+            root_moves = [move for _, move in scored_moves]
+            best_move = root_moves[0]
+            score = scored_moves[0][0][0]
+            self.completed_depth = depth
+            self.update_search_info(start_time, depth=depth, score=score, best_move=best_move)
+            if abs(score) > MATE_THRESHOLD:
+                break
 
+        self.clear_stop()
+        self.update_search_info(start_time)
         return best_move
+
+    def add_worker_stats(self, nodes, qnodes, cutoffs, first_move_cutoffs, tt_hits, tt_misses):
+        # Adds the counts of a finished parallel search task to this search
+        self.nodes += nodes
+        self.qnodes += qnodes
+        self.orderer.cutoffs += cutoffs
+        self.orderer.first_move_cutoffs += first_move_cutoffs
+        self.worker_tt_probes[0] += tt_hits
+        self.worker_tt_probes[1] += tt_misses
+
+    def search_root_move(self, gs, move, depth, alpha, deadline, max_nodes):
+        # Worker side of the parallel search: scores one root move of gs to the
+        # given depth, returning the score and the counts add_worker_stats()
+        # takes, or None when a limit cut it short. Scores at or below alpha are
+        # only upper bounds.
+        now = time.time()
+        if deadline is not None and now >= deadline and depth > 1:
+            return None
+        self.deadline = time.perf_counter() + (deadline - now) if deadline is not None else None
+        self.max_nodes = max_nodes
+        self.reset_search_info()
+        self.stop_requested = False
+        # depth 1 must always finish so the caller has a move to play
+        self.completed_depth = depth - 1
+
+        gs.make_move(move)
+        try:
+            score = -self.negamax(gs, depth - 1, -float('inf'), -alpha, ply=1)
+        except SearchAborted:
+            return None
+        return (score, self.nodes, self.qnodes, self.orderer.cutoffs, self.orderer.first_move_cutoffs,
+                self.tt.hits - self.tt_probes_at_start[0], self.tt.misses - self.tt_probes_at_start[1])
+
+    def get_executor(self):
+        if self.executor is None:
+            context = multiprocessing.get_context()
+            self.stop_event = context.Event()
+            self.executor = ProcessPoolExecutor(self.workers, mp_context=context, initializer=_init_worker,
+                                                initargs=(self.tt_size_mb, self.stop_event,
+                                                          self.tablebase.directory if self.tablebase else None))
+        return self.executor
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+            self.executor = None
+
+    def stop(self):
+        # Aborts a running search; find_best_move still returns the best move
+        # of the last completed iteration
+        self.stop_requested = True
+        if self.stop_event is not None:
+            self.stop_event.set()
+
+    def clear_stop(self):
+        # A finished search leaves no stop behind for the next one
+        self.stop_requested = False
+        if self.stop_event is not None:
+            self.stop_event.clear()
+
+    def check_limits(self):
+        # The first iteration always runs to completion so there is a move to return
+        if self.completed_depth == 0:
+            return
+        if self.stop_requested or (self.stop_event is not None and self.stop_event.is_set()):
+            raise SearchAborted()
+        if self.deadline is not None and time.perf_counter() >= self.deadline:
+            raise SearchAborted()
+        if self.max_nodes is not None and self.nodes >= self.max_nodes:
+            raise SearchAborted()
     
     def minimax(self, gs, is_maximizing, depth, alpha, beta):
-        if depth == 0 or gs.check_mate or gs.stale_mate:
-            if gs.check_mate:
-                return CHECKMATE if is_maximizing else -CHECKMATE
-            elif gs.stale_mate:
+        # White-relative scores on top of negamax, which scores for the side to move
+        if is_maximizing:
+            return self.negamax(gs, depth, alpha, beta)
+        return -self.negamax(gs, depth, -beta, -alpha)
+    
+    def negamax(self, gs, depth, alpha, beta, ply=0):
+        self.nodes += 1
+        if not self.nodes & LIMIT_CHECK_INTERVAL:
+            self.check_limits()
+
+        if ply > 0:
+            # A repeated position is a draw if the side to move wants it, so one
+            # repetition is enough; fifty quiet moves draw unless the last one mated
+            if gs.is_repetition():
+                return STALEMATE
+            if gs.is_fifty_move_draw() and (not gs.in_check() or gs.generate_legal_moves()):
                 return STALEMATE
-            return self.score_material(gs.pieces)
 
-        if is_maximizing: #Maximizing player
+        if self.tablebase is not None and ply > 0 and popcount(gs.board) <= MAX_PIECES:
+            value = self.tablebase.probe(gs)
+            if value is not None:
+                return self.score_from_tablebase(value, ply)
+
+        key = gs.zobrist_key
+        entry = self.tt.probe(key)
+        hash_move = None
+        if entry is not None and ply > 0:
+            tt_depth, tt_score, tt_bound, hash_move = entry
+            if tt_depth >= depth:
+                tt_score = self.score_from_tt(tt_score, ply)
+                if tt_bound == Bound.EXACT:
+                    return tt_score
+                elif tt_bound == Bound.LOWER:
+                    alpha = max(alpha, tt_score)
+                else:
+                    beta = min(beta, tt_score)
+                if alpha >= beta:
+                    return tt_score
+
+        if depth == 0:
+            return self.quiescence(gs, alpha, beta, ply)
+
+        original_alpha = alpha
+        best_score = -float('inf')
+        best_move = None
+        for i, move in enumerate(self.orderer.staged_moves(gs, ply, hash_move)):
+            gs.make_move(move)
+            score = -self.negamax(gs, depth - 1, -beta, -alpha, ply + 1)
+            gs.undo_move()
+            if score > best_score:
+                best_score = score
+                best_move = move
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        self.orderer.record_cutoff(gs, move, ply, depth, i)
+                        break
+
+        if best_move is None:
+            # every stage came up empty, so check was set by the last generation
+            return -CHECKMATE + ply if gs.check else STALEMATE
+
+        if best_score <= original_alpha:
+            bound = Bound.UPPER
+        elif best_score >= beta:
+            bound = Bound.LOWER
+        else:
+            bound = Bound.EXACT
+        self.tt.store(key, depth, self.score_to_tt(best_score, ply), bound, best_move)
+        return best_score
+
+    def quiescence(self, gs, alpha, beta, ply):
+        # Resolves captures and promotions at the horizon so the static score
+        # is never taken in the middle of an exchange
+        self.nodes += 1
+        self.qnodes += 1
+        if not self.nodes & LIMIT_CHECK_INTERVAL:
+            self.check_limits()
+
+        moves = gs.get_capture_moves()
+        if gs.check:
+            # standing pat is not an option in check: every evasion is searched
+            moves = gs.get_valid_moves()
+            if not moves:
+                return -CHECKMATE + ply
             best_score = -float('inf')
-            for move in gs.get_valid_moves():
-                gs.make_move(move)
-                score = self.minimax(gs, not is_maximizing, depth - 1, alpha, beta)
-                gs.undo_move()
-                best_score = max(best_score, score)
-                alpha = max(alpha, best_score)
-                if beta <= alpha:
-                    break
-            return best_score
-        else: # Minimizing player
-            best_score = float('inf')
-            for move in gs.get_valid_moves():
-                gs.make_move(move)
-                score = self.minimax(gs, not is_maximizing, depth - 1, alpha, beta)
-                gs.undo_move()
-                best_score = min(best_score, score)
-                beta = min(beta, best_score)
-                if beta <= alpha:
-                    break
-            return best_score
-    
-    def negamax(self, gs, is_maximizing, depth, alpha, beta):
-        if depth == 0 or gs.check_mate or gs.stale_mate:
-            if gs.check_mate:
-                return  CHECKMATE if is_maximizing else -CHECKMATE
-            elif gs.stale_mate:
-                return STALEMATE
-            return self.score_material(gs.pieces) if is_maximizing else -self.score_material(gs.pieces)
-        
-        score = -float('inf')
-        for move in gs.get_valid_moves():
+            stand_pat = None
+        else:
+            stand_pat = self.evaluate(gs)
+            if stand_pat >= beta or ply >= MAX_PLY:
+                return stand_pat
+            alpha = max(alpha, stand_pat)
+            best_score = stand_pat
+
+        for move in self.orderer.order_moves(gs, moves, ply):
+            if stand_pat is not None:
+                flag = move >> 12
+                # underpromotions are left to the full-width search
+                if MoveFlag.PROMOTE_KNIGHT <= flag < MoveFlag.PROMOTE_QUEEN:
+                    continue
+                victim = Piece.PAWN if flag == MoveFlag.EN_PASSANT else gs.mailbox[move >> 6 & 63]
+                gain = Evaluation.MG_PIECE_VALUES[victim] if victim is not None else 0
+                if flag == MoveFlag.PROMOTE_QUEEN:
+                    gain += Evaluation.MG_PIECE_VALUES[Piece.QUEEN] - Evaluation.MG_PIECE_VALUES[Piece.PAWN]
+                if stand_pat + gain + DELTA_MARGIN <= alpha:
+                    continue
+
             gs.make_move(move)
-            score = max(score, -self.negamax(gs, not is_maximizing, depth - 1, -beta, -alpha))
+            score = -self.quiescence(gs, -beta, -alpha, ply + 1)
             gs.undo_move()
-            alpha = max(alpha, score)
-            if beta <= alpha:
-                break
+            if score > best_score:
+                best_score = score
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        break
+        return best_score
+
+    def score_to_tt(self, score, ply):
+        if score > MATE_THRESHOLD:
+            return score + ply
+        if score < -MATE_THRESHOLD:
+            return score - ply
         return score
-    
 
-    # TODO: Scoring based on piece posiiton
+    def score_from_tt(self, score, ply):
+        if score > MATE_THRESHOLD:
+            return score - ply
+        if score < -MATE_THRESHOLD:
+            return score + ply
+        return score
+
+    def score_from_tablebase(self, value, ply):
+        # Table values count plies to mate from the probed node
+        if value > 0:
+            return CHECKMATE - ply - value
+        if value < 0:
+            return -CHECKMATE + ply - value - 1
+        return STALEMATE
+
+    def evaluate(self, gs):
+        # Material and piece-square score in centipawns from the point of view of
+        # the side to move, kept up to date by make_move/undo_move
+        score = Evaluation.evaluate(gs)
+        return score if gs.color == Color.WHITE else -score
+
     def score_material(self, pieces):
         score = 0
         for color in Color:
@@ -110,6 +570,19 @@ class AIMoveFinder:
                         score -= piece_score[piece_type]
         return score
 
-        
 
-        
+# Search state of a parallel search worker process, created once per process so
+# its transposition table carries over from one task to the next
+_worker_finder = None
+
+
+def _init_worker(tt_size_mb, stop_event, tablebase_directory):
+    global _worker_finder
+    _worker_finder = AIMoveFinder(tt_size_mb, tablebase=Tablebase(tablebase_directory) if tablebase_directory else None)
+    _worker_finder.stop_event = stop_event
+
+
+def _search_root_move(state, recent_keys, move, depth, alpha, deadline, max_nodes):
+    gs = ChessEngine.ChessBoard.unpack(state)
+    gs.key_history = recent_keys
+    return _worker_finder.search_root_move(gs, move, depth, alpha, deadline, max_nodes)
@@ -0,0 +1,131 @@
+# Squares are numbered like in ChessBoard: square = row * 8 + col, where row 0 is
+# the 8th rank and col 0 is the a-file. Square s lives on bit (63 - s), so every
+# bitboard is a plain Python int between 0 and FULL_BB.
+
+FULL_BB = 0xFFFFFFFFFFFFFFFF
+FILE_A_BB = 0x8080808080808080
+FILE_H_BB = 0x0101010101010101
+NOT_FILE_A_BB = FULL_BB ^ FILE_A_BB
+NOT_FILE_H_BB = FULL_BB ^ FILE_H_BB
+
+SQUARE_BB = [1 << (63 - sq) for sq in range(64)]
+ROW_COL = [(sq // 8, sq % 8) for sq in range(64)]
+ROW_BB = [0xFF << (56 - 8 * row) for row in range(8)]
+
+# Square deltas of a single pawn push and of the two pawn captures, per color
+PAWN_PUSH = (-8, 8)
+PAWN_CAPTURES = (((-9, NOT_FILE_A_BB), (-7, NOT_FILE_H_BB)),
+                 ((7, NOT_FILE_A_BB), (9, NOT_FILE_H_BB)))
+# Row a pawn lands on after its first single push, per color
+PAWN_DOUBLE_PUSH_ROW_BB = (ROW_BB[5], ROW_BB[2])
+PROMOTION_ROW_BB = (ROW_BB[0], ROW_BB[7])
+
+
+def square_of(bb):
+    # Lowest square index (i.e. highest set bit) of a non-empty bitboard
+    return 64 - bb.bit_length()
+
+
+def shift(bb, delta):
+    # Moves every set square of bb by delta squares
+    if delta > 0:
+        return bb >> delta
+    return (bb << -delta) & FULL_BB
+
+
+def popcount(bb):
+    return bin(bb).count("1")
+
+
+def _step_attacks(offsets):
+    table = []
+    for sq in range(64):
+        row, col = ROW_COL[sq]
+        attacks = 0
+        for dir_r, dir_c in offsets:
+            r, c = row + dir_r, col + dir_c
+            if 0 <= r <= 7 and 0 <= c <= 7:
+                attacks |= SQUARE_BB[r * 8 + c]
+        table.append(attacks)
+    return table
+
+
+def _ray(sq, dir_r, dir_c):
+    row, col = ROW_COL[sq]
+    squares = []
+    r, c = row + dir_r, col + dir_c
+    while 0 <= r <= 7 and 0 <= c <= 7:
+        squares.append(r * 8 + c)
+        r += dir_r
+        c += dir_c
+    return squares
+
+
+def _line_attacks(sq, directions):
+    # Attacks along one line through sq (two opposite rays), for every
+    # occupancy of the squares that can block it. Edge squares are left out of
+    # the mask since a piece standing there never hides anything behind it.
+    rays = [_ray(sq, dir_r, dir_c) for dir_r, dir_c in directions]
+    mask = 0
+    for ray in rays:
+        for s in ray[:-1]:
+            mask |= SQUARE_BB[s]
+
+    table = {}
+    blockers = 0
+    while True:
+        attacks = 0
+        for ray in rays:
+            for s in ray:
+                attacks |= SQUARE_BB[s]
+                if blockers & SQUARE_BB[s]:
+                    break
+        table[blockers] = attacks
+        blockers = (blockers - mask) & mask
+        if blockers == 0:
+            break
+    return mask, table
+
+
+KNIGHT_ATTACKS = _step_attacks([(1, -2), (1, 2), (-1, -2), (-1, 2), (-2, -1), (-2, 1), (2, -1), (2, 1)])
+KING_ATTACKS = _step_attacks([(-1, -1), (-1, 1), (1, -1), (1, 1), (-1, 0), (0, 1), (1, 0), (0, -1)])
+# Squares attacked by a pawn of the given color standing on a square
+PAWN_ATTACKS = [_step_attacks([(-1, -1), (-1, 1)]), _step_attacks([(1, -1), (1, 1)])]
+
+# Sliding attacks are looked up one line at a time: the occupancy masked to the
+# line is the key of a per-square dict holding the precomputed attack set. This
+# is the rotated-bitboard idea with a dict standing in for the rotated index.
+RANK_MASK, RANK_ATTACKS = zip(*[_line_attacks(sq, ((0, -1), (0, 1))) for sq in range(64)])
+FILE_MASK, FILE_ATTACKS = zip(*[_line_attacks(sq, ((-1, 0), (1, 0))) for sq in range(64)])
+DIAGONAL_MASK, DIAGONAL_ATTACKS = zip(*[_line_attacks(sq, ((-1, -1), (1, 1))) for sq in range(64)])
+ANTI_DIAGONAL_MASK, ANTI_DIAGONAL_ATTACKS = zip(*[_line_attacks(sq, ((-1, 1), (1, -1))) for sq in range(64)])
+
+
+def rook_attacks(sq, occupied):
+    return (RANK_ATTACKS[sq][occupied & RANK_MASK[sq]]
+            | FILE_ATTACKS[sq][occupied & FILE_MASK[sq]])
+
+
+def bishop_attacks(sq, occupied):
+    return (DIAGONAL_ATTACKS[sq][occupied & DIAGONAL_MASK[sq]]
+            | ANTI_DIAGONAL_ATTACKS[sq][occupied & ANTI_DIAGONAL_MASK[sq]])
+
+
+def queen_attacks(sq, occupied):
+    return rook_attacks(sq, occupied) | bishop_attacks(sq, occupied)
+
+
+def _between_table():
+    # BETWEEN[a][b] holds the squares strictly between a and b when they share a
+    # rank, file or diagonal, and 0 otherwise
+    table = [[0] * 64 for _ in range(64)]
+    for sq in range(64):
+        for dir_r, dir_c in ((-1, -1), (-1, 1), (1, -1), (1, 1), (-1, 0), (0, 1), (1, 0), (0, -1)):
+            between = 0
+            for s in _ray(sq, dir_r, dir_c):
+                table[sq][s] = between
+                between |= SQUARE_BB[s]
+    return table
+
+
+BETWEEN = _between_table()
@@ -1,413 +1,828 @@
-from Constants import Color, Piece, File, Rank, PieceMapping
-import numpy as np
+import struct
+from Constants import Color, Piece, File, Rank, PieceMapping, CastlingRight, MoveFlag
+from Bitboards import (FULL_BB, SQUARE_BB, ROW_COL, BETWEEN, PAWN_PUSH, PAWN_CAPTURES, PAWN_DOUBLE_PUSH_ROW_BB,
+                       PROMOTION_ROW_BB,
+                       KNIGHT_ATTACKS, KING_ATTACKS, PAWN_ATTACKS, rook_attacks, bishop_attacks, queen_attacks,
+                       shift, square_of, popcount)
+from Zobrist import PIECE_KEYS, BLACK_TO_MOVE_KEY, CASTLING_KEYS, EN_PASSANT_KEYS, compute_hash
+from Evaluation import MG_TABLE, EG_TABLE, PHASE_WEIGHTS, compute_scores
+
+ALL_CASTLING_RIGHTS = CastlingRight.WKS | CastlingRight.WQS | CastlingRight.BKS | CastlingRight.BQS
+
+# Castling rights that survive a move touching a square: moving a king or rook
+# away, or capturing a rook on its home square, clears the matching rights
+CASTLING_MASK = [ALL_CASTLING_RIGHTS] * 64
+CASTLING_MASK[60] &= ~(CastlingRight.WKS | CastlingRight.WQS) # e1
+CASTLING_MASK[63] &= ~CastlingRight.WKS # h1
+CASTLING_MASK[56] &= ~CastlingRight.WQS # a1
+CASTLING_MASK[4] &= ~(CastlingRight.BKS | CastlingRight.BQS) # e8
+CASTLING_MASK[7] &= ~CastlingRight.BKS # h8
+CASTLING_MASK[0] &= ~CastlingRight.BQS # a8
+
+# King destination square -> (rook start square, rook end square)
+CASTLE_ROOK_SQUARES = {62: (63, 61), 58: (56, 59), 6: (7, 5), 2: (0, 3)}
+
+# Pieces a pawn may promote to, most valuable first, and their move code flags
+PROMOTION_PIECES = (Piece.QUEEN, Piece.ROOK, Piece.BISHOP, Piece.KNIGHT)
+PROMOTION_FLAGS = tuple((piece + 3) << 12 for piece in PROMOTION_PIECES)
+FEN_PIECES = {'p': Piece.PAWN, 'n': Piece.KNIGHT, 'b': Piece.BISHOP, 'r': Piece.ROOK, 'q': Piece.QUEEN, 'k': Piece.KING}
+FEN_CASTLING = {'K': CastlingRight.WKS, 'Q': CastlingRight.WQS, 'k': CastlingRight.BKS, 'q': CastlingRight.BQS}
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+# Castling right -> (king square, rook square) it needs, as checked when loading a FEN
+CASTLING_SQUARES = {CastlingRight.WKS: (Color.WHITE, 60, 63), CastlingRight.WQS: (Color.WHITE, 60, 56),
+                    CastlingRight.BKS: (Color.BLACK, 4, 7), CastlingRight.BQS: (Color.BLACK, 4, 0)}
+
+# Packed position: occupancy bitboard, one nibble (color * 6 + piece) per occupied
+# square in square order, flags (side to move in bit 0, castling rights above),
+# en passant square (NO_SQUARE if none), halfmove clock and fullmove number
+PACKED_FORMAT = struct.Struct(">Q16sBBHH")
+NO_SQUARE = 0xFF
+# Plies without a capture or pawn move after which the game is drawn
+FIFTY_MOVE_PLIES = 100
 
 class ChessBoard():
     def __init__(self):
-        self.pieces = np.zeros((2,6), dtype=np.uint64) 
-        self.combined_color = np.zeros(2, dtype=np.uint64) 
-        self.board = np.uint64(0)
+        self.pieces = [[0] * 6, [0] * 6]
+        self.combined_color = [0, 0]
+        self.board = 0
+        # Piece type standing on every square (None when empty); its color follows from combined_color
+        self.mailbox = [None] * 64
         self.color = Color.WHITE
         self.move_log = [] 
+        # One undo record per move in move_log: (captured piece type, castling rights, en passant square,
+        # halfmove clock, midgame score, endgame score, phase) as they were before the move
+        self.state_log = []
+        # Zobrist key of the position before every move, for undo and repetition detection
+        self.key_history = []
+        # Plies since the last capture or pawn move
+        self.halfmove_clock = 0
         self.check_mate = False
         self.stale_mate = False
-        self.pins = []
+        self.pins = {}
         self.check = []
         self.captured_piece = False
         self.en_passant_possible = ()
-        self.current_castling_rights = CastleRights(True, True, True, True)
-        self.castle_rights_log = [CastleRights(self.current_castling_rights.wks, self.current_castling_rights.bks, 
-                                               self.current_castling_rights.wqs, self.current_castling_rights.bqs)]
+        self.castling = ALL_CASTLING_RIGHTS
+        # Fullmove number of the position the game started from
+        self.first_move_number = 1
+        # 64-bit key of the position: pieces, side to move, castling rights and en passant file
+        self.zobrist_key = compute_hash(self)
+        # Running white-relative material + piece-square scores and game phase (see Evaluation)
+        self.mg_score = 0
+        self.eg_score = 0
+        self.phase = 0
+
+    @property
+    def current_castling_rights(self):
+        return CastleRights(bool(self.castling & CastlingRight.WKS), bool(self.castling & CastlingRight.BKS),
+                            bool(self.castling & CastlingRight.WQS), bool(self.castling & CastlingRight.BQS))
     
     def make_move(self, move):
+        # move is a move code from the generator (see Move); a Move is accepted as well
+        if isinstance(move, Move):
+            move = move.move_ID
+        us = self.color
+        them = us ^ 1
+        own = self.pieces[us]
+        enemy = self.pieces[them]
+        combined = self.combined_color
+        mailbox = self.mailbox
+        start = move & 63
+        end = move >> 6 & 63
+        flag = move >> 12 & 15
+        start_bb = SQUARE_BB[start]
+        end_bb = SQUARE_BB[end]
+        moved_piece_type = mailbox[start]
+
+        #  En passant captures take the pawn behind the end square
+        captured_sq = end - PAWN_PUSH[us] if flag == MoveFlag.EN_PASSANT else end
+        captured_piece_type = mailbox[captured_sq]
+
+        self.state_log.append((captured_piece_type, self.castling, self.en_passant_possible, self.halfmove_clock,
+                               self.mg_score, self.eg_score, self.phase))
+        key = self.zobrist_key
+        self.key_history.append(key)
+        if moved_piece_type == Piece.PAWN or captured_piece_type is not None:
+            self.halfmove_clock = 0
+        else:
+            self.halfmove_clock += 1
+        own_keys = PIECE_KEYS[us]
+        own_mg = MG_TABLE[us]
+        own_eg = EG_TABLE[us]
+
+        # Every bitboard is updated by XOR-ing the from/to deltas in place
+        if captured_piece_type is not None:
+            captured_bb = SQUARE_BB[captured_sq]
+            enemy[captured_piece_type] ^= captured_bb
+            combined[them] ^= captured_bb
+            mailbox[captured_sq] = None
+            key ^= PIECE_KEYS[them][captured_piece_type][captured_sq]
+            self.mg_score -= MG_TABLE[them][captured_piece_type][captured_sq]
+            self.eg_score -= EG_TABLE[them][captured_piece_type][captured_sq]
+            self.phase -= PHASE_WEIGHTS[captured_piece_type]
+
+        if flag >= MoveFlag.PROMOTE_KNIGHT:
+            promoted = flag - 3
+            own[Piece.PAWN] ^= start_bb
+            own[promoted] ^= end_bb
+            mailbox[end] = promoted
+            key ^= own_keys[Piece.PAWN][start] ^ own_keys[promoted][end]
+            self.mg_score += own_mg[promoted][end] - own_mg[Piece.PAWN][start]
+            self.eg_score += own_eg[promoted][end] - own_eg[Piece.PAWN][start]
+            self.phase += PHASE_WEIGHTS[promoted]
+        else:
+            own[moved_piece_type] ^= start_bb | end_bb
+            mailbox[end] = moved_piece_type
+            key ^= own_keys[moved_piece_type][start] ^ own_keys[moved_piece_type][end]
+            self.mg_score += own_mg[moved_piece_type][end] - own_mg[moved_piece_type][start]
+            self.eg_score += own_eg[moved_piece_type][end] - own_eg[moved_piece_type][start]
+        mailbox[start] = None
+        combined[us] ^= start_bb | end_bb
+
+        if flag == MoveFlag.CASTLE:
+            rook_start, rook_end = CASTLE_ROOK_SQUARES[end]
+            rook_bb = SQUARE_BB[rook_start] | SQUARE_BB[rook_end]
+            own[Piece.ROOK] ^= rook_bb
+            combined[us] ^= rook_bb
+            mailbox[rook_start] = None
+            mailbox[rook_end] = Piece.ROOK
+            key ^= own_keys[Piece.ROOK][rook_start] ^ own_keys[Piece.ROOK][rook_end]
+            self.mg_score += own_mg[Piece.ROOK][rook_end] - own_mg[Piece.ROOK][rook_start]
+            self.eg_score += own_eg[Piece.ROOK][rook_end] - own_eg[Piece.ROOK][rook_start]
+
+        self.board = combined[Color.WHITE] | combined[Color.BLACK]
 
-        for piece_type in Piece:
-            if self.pieces[self.color][piece_type] & move.piece_moved:
-                move.moved_piece_type = piece_type
-                move.moved_piece_color = self.color
-                break
-
-        #  En passant captures
-        if move.is_en_passant_move:
-            move.is_capture = True
-            for piece_type in Piece:
-                en_passant_captured = move.piece_captured >> 8 if self.color == Color.WHITE else move.piece_captured << 8
-                if self.pieces[~self.color][piece_type] & en_passant_captured:
-                    move.captured_piece_type = piece_type                
-        
-        #  Regular captures
-        elif self.combined_color[~self.color] & move.piece_captured:
-            move.is_capture = True
-            for piece_type in Piece:
-                if self.pieces[~self.color][piece_type] & move.piece_captured:
-                    move.captured_piece_type = piece_type
-                    break
-        
         #  Set en passant square
-        if move.moved_piece_type == Piece.PAWN and abs(move.start_row - move.end_row) == 2:
-            self.en_passant_possible = ((move.start_row + move.end_row)//2, move.end_col)
+        if self.en_passant_possible:
+            key ^= EN_PASSANT_KEYS[self.en_passant_possible[1]]
+        if moved_piece_type == Piece.PAWN and (start - end == 16 or end - start == 16):
+            self.en_passant_possible = ROW_COL[(start + end) >> 1]
+            key ^= EN_PASSANT_KEYS[end & 7]
         else:
             self.en_passant_possible = ()
 
-        move.check_pawn_promotion()
-
-        for piece_type in Piece:
-            if self.pieces[self.color][piece_type] & move.piece_moved:
-                self.pieces[self.color][piece_type] &= ~(np.uint64(move.piece_moved))     
-                if move.is_pawn_promotion:
-                    self.pieces[self.color][Piece.QUEEN] |= np.uint64(move.piece_captured)
-                else:
-                    self.pieces[self.color][piece_type] |= np.uint64(move.piece_captured)
-                    break  
-        
-        if move.is_en_passant_move:
-            en_passant_captured = move.piece_captured >> 8 if self.color == Color.WHITE else move.piece_captured << 8
-            for piece_type in Piece:
-                if self.pieces[~self.color][piece_type] & en_passant_captured:
-                    self.pieces[~self.color][piece_type] &= ~(np.uint64(en_passant_captured))   
-                    break  
-
-        else:
-            for piece_type in Piece:
-                if self.pieces[~self.color][piece_type] & move.piece_captured:
-                    self.pieces[~self.color][piece_type] &= ~(np.uint64(move.piece_captured))   
-                    break  
-        
-        if move.is_castle_move:
-            if move.end_col - move.start_col == 2: # kingside castle
-                rightmost_rook_start = self.pieces[self.color][Piece.ROOK] & np.uint64(~self.pieces[self.color][Piece.ROOK] + 1)
-                if rightmost_rook_start:
-                    self.pieces[self.color][Piece.ROOK] &= ~rightmost_rook_start
-                    rightmost_rook_end = self.get_bit_mask(move.end_row, move.end_col-1)
-                    self.pieces[self.color][Piece.ROOK] |= rightmost_rook_end
-            else: # queenside castle
-                highest_bit = self.find_highest_set_bit_position(self.pieces[self.color][Piece.ROOK])
-                if highest_bit >= 0:
-                    leftmost_rook_start = self.pieces[self.color][Piece.ROOK] & np.uint64(1 << highest_bit)
-                    self.pieces[self.color][Piece.ROOK] &= ~leftmost_rook_start
-                    lefttmost_rook_end = self.get_bit_mask(move.end_row, move.end_col+1)
-                    self.pieces[self.color][Piece.ROOK] |= lefttmost_rook_end
-
-        # Castling rights
-        self.update_castle_rights(move)
-        self.castle_rights_log.append(CastleRights(self.current_castling_rights.wks, self.current_castling_rights.bks, 
-                                               self.current_castling_rights.wqs, self.current_castling_rights.bqs))
-
-        self.combined_color = np.zeros(2, dtype=np.uint64) 
-        for p in Piece:
-            for c in Color:
-                self.combined_color[c] |= self.pieces[c][p]
-        
-        self.board = np.uint64(0)
-        self.board = self.combined_color[Color.WHITE] | self.combined_color[Color.BLACK]
+        key ^= CASTLING_KEYS[self.castling]
+        self.castling &= CASTLING_MASK[start] & CASTLING_MASK[end]
+        self.zobrist_key = key ^ CASTLING_KEYS[self.castling] ^ BLACK_TO_MOVE_KEY
 
-        self.move_log.append(move)
+        # the log keeps the moved and captured pieces too, so it can be shown as notation
+        self.move_log.append(move & 0xFFFF | (moved_piece_type + 1) << 16
+                             | (captured_piece_type + 1 if captured_piece_type is not None else 0) << 19)
         self.color = ~self.color
 
-
-    
     def undo_move(self):
         if self.move_log:
             move = self.move_log.pop()
+            (captured_piece_type, self.castling, self.en_passant_possible, self.halfmove_clock,
+             self.mg_score, self.eg_score, self.phase) = self.state_log.pop()
+            self.zobrist_key = self.key_history.pop()
             self.color = ~self.color
-
-            if move.is_pawn_promotion:
-                self.pieces[self.color][Piece.QUEEN] &= ~(np.uint64(move.piece_captured))
-                self.pieces[self.color][Piece.PAWN] |= np.uint64(move.piece_moved)
+            us = self.color
+            them = us ^ 1
+            own = self.pieces[us]
+            combined = self.combined_color
+            mailbox = self.mailbox
+            start = move & 63
+            end = move >> 6 & 63
+            flag = move >> 12 & 15
+            start_bb = SQUARE_BB[start]
+            end_bb = SQUARE_BB[end]
+            moved_piece_type = (move >> 16 & 7) - 1
+
+            if flag >= MoveFlag.PROMOTE_KNIGHT:
+                own[flag - 3] ^= end_bb
+                own[Piece.PAWN] ^= start_bb
             else:
-                for piece_type in Piece:
-                    if self.pieces[self.color][piece_type] & move.piece_captured:
-                        self.pieces[self.color][piece_type] &= ~(np.uint64(move.piece_captured))
-                        self.pieces[self.color][piece_type] |= np.uint64(move.piece_moved)
-                        break
-            
-            if move.is_capture:
-                if move.is_en_passant_move:
-                    en_passant_captured = move.piece_captured >> 8 if self.color == Color.WHITE else move.piece_captured << 8
-                    self.pieces[~self.color][move.captured_piece_type] |= np.uint64(en_passant_captured)
-                    self.en_passant_possible = (move.end_row, move.end_col)
-                else:
-                    self.pieces[~self.color][move.captured_piece_type] |= move.piece_captured
-            else:
-                if len(self.move_log) > 0:
-                    previous_move = self.move_log[-1]
-    
-                    if previous_move.moved_piece_type == Piece.PAWN and abs(previous_move.start_row - previous_move.end_row) == 2:
-                        self.en_passant_possible = ((previous_move.start_row + previous_move.end_row)//2, previous_move.end_col)
-                    else:
-                        self.en_passant_possible = ()
-                else:
-                    self.en_passant_possible = ()
-            
-            # Undo castle rights
-            self.castle_rights_log.pop()
-            self.current_castling_rights = self.castle_rights_log[-1]
-
-            # Undo castle moves
-            if move.is_castle_move:
-                if move.end_col - move.start_col == 2: # kingside castle
-                    rightmost_rook_start = self.pieces[self.color][Piece.ROOK] & np.uint64(~self.pieces[self.color][Piece.ROOK] + 1)
-                    if rightmost_rook_start:
-                        self.pieces[self.color][Piece.ROOK] &= ~rightmost_rook_start
-                        rightmost_rook_end = self.get_bit_mask(move.end_row, move.end_col+1)
-                        self.pieces[self.color][Piece.ROOK] |= rightmost_rook_end
-                else: # queenside castle
-                    highest_bit = self.find_highest_set_bit_position(self.pieces[self.color][Piece.ROOK])
-                    if highest_bit >= 0:
-                        leftmost_rook_start = self.pieces[self.color][Piece.ROOK] & np.uint64(1 << highest_bit)
-                        self.pieces[self.color][Piece.ROOK] &= ~leftmost_rook_start
-                        lefttmost_rook_end = self.get_bit_mask(move.end_row, move.end_col-2)
-                        self.pieces[self.color][Piece.ROOK] |= lefttmost_rook_end
-            
-            self.combined_color = np.zeros(2, dtype=np.uint64) 
-            for p in Piece:
-                for c in Color:
-                    self.combined_color[c] |= self.pieces[c][p]
-            
-            self.board = self.combined_color[Color.WHITE] | self.combined_color[Color.BLACK]
-
-    def update_castle_rights(self, move):
-        if move.moved_piece_type == Piece.KING and move.moved_piece_color == Color.WHITE:
-            self.current_castling_rights.wks = False
-            self.current_castling_rights.wqs = False
-        elif move.moved_piece_type == Piece.KING and move.moved_piece_color == Color.BLACK:
-            self.current_castling_rights.bks = False
-            self.current_castling_rights.bqs = False
-        elif move.moved_piece_type == Piece.ROOK and move.moved_piece_color == Color.WHITE:
-            if move.start_row == 7:
-                if move.start_col == 0: # left rook
-                    self.current_castling_rights.wqs = False
-                elif move.start_col == 7: # right rook
-                    self.current_castling_rights.wks = False
-        elif move.moved_piece_type == Piece.ROOK and move.moved_piece_color == Color.BLACK:
-            if move.start_row == 0:
-                if move.start_col == 0: # left rook
-                    self.current_castling_rights.bqs = False
-                elif move.start_col == 7: # right rook
-                    self.current_castling_rights.bks = False
+                own[moved_piece_type] ^= start_bb | end_bb
+            mailbox[start] = moved_piece_type
+            mailbox[end] = None
+            combined[us] ^= start_bb | end_bb
+
+            if captured_piece_type is not None:
+                captured_sq = end - PAWN_PUSH[us] if flag == MoveFlag.EN_PASSANT else end
+                captured_bb = SQUARE_BB[captured_sq]
+                self.pieces[them][captured_piece_type] ^= captured_bb
+                combined[them] ^= captured_bb
+                mailbox[captured_sq] = captured_piece_type
+
+            if flag == MoveFlag.CASTLE:
+                rook_start, rook_end = CASTLE_ROOK_SQUARES[end]
+                rook_bb = SQUARE_BB[rook_start] | SQUARE_BB[rook_end]
+                own[Piece.ROOK] ^= rook_bb
+                combined[us] ^= rook_bb
+                mailbox[rook_end] = None
+                mailbox[rook_start] = Piece.ROOK
+
+            self.board = combined[Color.WHITE] | combined[Color.BLACK]
+
+    def is_repetition(self, times=1):
+        # True if the current position occurred at least `times` times before.
+        # Captures and pawn moves cannot be undone, so only the last
+        # halfmove_clock positions can match, and only every other one has the
+        # same side to move.
+        key = self.zobrist_key
+        history = self.key_history
+        earliest = max(len(history) - self.halfmove_clock, 0)
+        count = 0
+        for i in range(len(history) - 2, earliest - 1, -2):
+            if history[i] == key:
+                count += 1
+                if count >= times:
+                    return True
+        return False
+
+    def is_fifty_move_draw(self):
+        # Checkmate on the last of the hundred plies still wins; callers check for it first
+        return self.halfmove_clock >= FIFTY_MOVE_PLIES
+
+    def get_recent_keys(self):
+        # The part of key_history the current position can still repeat
+        return self.key_history[max(len(self.key_history) - self.halfmove_clock, 0):]
 
     def get_valid_moves(self):
-        # Making a copy to make sure we do not modify the original state of the board
-        original_pieces = np.copy(self.pieces)
-        original_combined_color = np.copy(self.combined_color)
-        original_board = self.board
-        original_color = self.color
-        original_move_log = list(self.move_log)
-        temp_en_passant_possible = self.en_passant_possible
-        original_castle_rights_log = [CastleRights(cr.wks, cr.bks, cr.wqs, cr.bqs) for cr in self.castle_rights_log]
-        temp_castling_rights = CastleRights(self.current_castling_rights.wks, self.current_castling_rights.bks, 
-                                            self.current_castling_rights.wqs, self.current_castling_rights.bqs)
-        moves = self.get_all_possible_moves()
-        
-        king_bitmap = self.pieces[self.color][Piece.KING]
-        king_row, king_col = self.get_coordinates(king_bitmap)
-        self.get_castle_moves(king_row, king_col, moves)
-
-        for i in range(len(moves) - 1,-1, -1):
-            self.make_move(moves[i])
-            self.color = ~self.color
-            if self.in_check():
-                moves.remove(moves[i])
-            self.color = ~self.color
-            self.undo_move()
-        
+        moves = self.generate_legal_moves()
+
         if len(moves) == 0: #checkmate or stalemate
-            if self.in_check():
+            if self.check:
                 self.check_mate = True
             else:
                 self.stale_mate = True
         else:
             self.check_mate = False
             self.stale_mate = False
-        
-        # restoring original board state
-        self.pieces = original_pieces
-        self.combined_color = original_combined_color
-        self.board = original_board
-        self.color = original_color
-        self.move_log = original_move_log
-        self.en_passant_possible = temp_en_passant_possible
-        self.castle_rights_log = original_castle_rights_log
-        self.current_castling_rights = temp_castling_rights
 
         return moves
-                        
+
+    def get_capture_moves(self):
+        # Legal captures and promotions only, for quiescence search
+        return self.generate_legal_moves(quiet=False)
+
+    def get_quiet_moves(self):
+        # The legal moves get_capture_moves leaves out
+        return self.generate_legal_moves(captures=False)
+
+    def generate_legal_moves(self, quiet=True, captures=True):
+        # Checkers and pinned pieces are found once up front, so every move
+        # generated below is already legal and nothing has to be made/undone.
+        # captures covers captures and promotions, quiet all other moves.
+        king_sq = square_of(self.pieces[self.color][Piece.KING])
+        self.check, self.pins = self.get_checks_and_pins(king_sq)
+
+        moves = []
+        self.get_legal_king_moves(king_sq, moves, quiet, captures)
+        if len(self.check) < 2: # in double check only the king can move
+            if self.check:
+                # block the check or capture the checking piece
+                target_mask = BETWEEN[king_sq][self.check[0]] | SQUARE_BB[self.check[0]]
+            else:
+                target_mask = FULL_BB
+                if quiet:
+                    king_row, king_col = ROW_COL[king_sq]
+                    self.get_castle_moves(king_row, king_col, moves)
+            self.get_piece_moves(target_mask, self.pins, moves, quiet, captures)
+        return moves
+
+    def is_legal(self, move):
+        # Whether a move code from elsewhere, such as a hash or killer move, is
+        # legal here, found without generating the moves of the position
+        us = self.color
+        start = move & 63
+        end = move >> 6 & 63
+        flag = move >> 12 & 15
+        start_bb = SQUARE_BB[start]
+        end_bb = SQUARE_BB[end]
+        own = self.combined_color[us]
+        if not own & start_bb or own & end_bb:
+            return False
+
+        piece = self.mailbox[start]
+        if piece == Piece.PAWN:
+            moves = []
+            self.get_pawn_moves(start_bb, FULL_BB, {}, moves)
+            if move not in moves:
+                return False
+        elif flag == MoveFlag.CASTLE:
+            # castling is generated only when the king passes no attacked square
+            moves = []
+            if piece == Piece.KING:
+                self.get_castle_moves(start >> 3, start & 7, moves)
+            return move in moves
+        elif flag != MoveFlag.NONE:
+            return False
+        elif piece == Piece.KNIGHT:
+            if not KNIGHT_ATTACKS[start] & end_bb:
+                return False
+        elif piece == Piece.BISHOP:
+            if not bishop_attacks(start, self.board) & end_bb:
+                return False
+        elif piece == Piece.ROOK:
+            if not rook_attacks(start, self.board) & end_bb:
+                return False
+        elif piece == Piece.QUEEN:
+            if not queen_attacks(start, self.board) & end_bb:
+                return False
+        elif not KING_ATTACKS[start] & end_bb:
+            return False
+
+        # the move can be made; it is legal if it leaves the king safe
+        self.make_move(move)
+        legal = not self.is_square_attacked(square_of(self.pieces[us][Piece.KING]), us ^ 1)
+        self.undo_move()
+        return legal
+
+    def get_checks_and_pins(self, king_sq):
+        # Returns the squares of the pieces giving check and a dict mapping every
+        # pinned piece's square to the line it may still move along
+        them = self.color ^ 1
+        enemy = self.pieces[them]
+        own = self.combined_color[self.color]
+
+        checkers = self.get_attackers(king_sq, them, self.board)
+        check = []
+        while checkers:
+            sq = 64 - checkers.bit_length()
+            checkers ^= SQUARE_BB[sq]
+            check.append(sq)
+
+        # Enemy sliders that would see the king if our own pieces were not there
+        enemy_occupancy = self.combined_color[them]
+        snipers = ((rook_attacks(king_sq, enemy_occupancy) & (enemy[Piece.ROOK] | enemy[Piece.QUEEN]))
+                   | (bishop_attacks(king_sq, enemy_occupancy) & (enemy[Piece.BISHOP] | enemy[Piece.QUEEN])))
+        pins = {}
+        while snipers:
+            sq = 64 - snipers.bit_length()
+            snipers ^= SQUARE_BB[sq]
+            blockers = BETWEEN[king_sq][sq] & self.board
+            if blockers & own and not blockers & (blockers - 1):
+                pins[64 - blockers.bit_length()] = BETWEEN[king_sq][sq] | SQUARE_BB[sq]
+        return check, pins
+
+    def get_legal_king_moves(self, king_sq, moves, quiet=True, captures=True):
+        # The king is taken off the board so sliders attack through its square
+        them = self.color ^ 1
+        occupied = self.board ^ SQUARE_BB[king_sq]
+        targets = KING_ATTACKS[king_sq] & self.get_target_squares(quiet, captures)
+        while targets:
+            end = 64 - targets.bit_length()
+            targets ^= SQUARE_BB[end]
+            if not self.is_square_attacked(end, them, occupied):
+                moves.append(king_sq | end << 6)
+
     def in_check(self):
-        king_bitmap = self.pieces[self.color][Piece.KING]
-        king_row, king_col = self.get_coordinates(king_bitmap)
-        return self.square_under_attack(king_row, king_col)
+        king_sq = square_of(self.pieces[self.color][Piece.KING])
+        return self.is_square_attacked(king_sq, self.color ^ 1)
 
     def square_under_attack(self, r, c):
-        self.color = ~self.color
-        opp_moves = self.get_all_possible_moves()
-        self.color = ~self.color
-        for move in opp_moves:
-            if move.end_row == r and move.end_col == c:
-                return True
-        return False
-
+        return self.is_square_attacked(r * 8 + c, self.color ^ 1)
+
+    # Attack detection looks outward from the target square: a piece of a given
+    # type attacks the square exactly when the same piece standing on the
+    # square would attack it (pawns use the attack table of the other color)
+    def is_square_attacked(self, sq, color, occupied=None):
+        if occupied is None:
+            occupied = self.board
+        pieces = self.pieces[color]
+        if KNIGHT_ATTACKS[sq] & pieces[Piece.KNIGHT]:
+            return True
+        if PAWN_ATTACKS[color ^ 1][sq] & pieces[Piece.PAWN]:
+            return True
+        if KING_ATTACKS[sq] & pieces[Piece.KING]:
+            return True
+        if bishop_attacks(sq, occupied) & (pieces[Piece.BISHOP] | pieces[Piece.QUEEN]):
+            return True
+        return bool(rook_attacks(sq, occupied) & (pieces[Piece.ROOK] | pieces[Piece.QUEEN]))
+
+    def get_attackers(self, sq, color, occupied=None):
+        if occupied is None:
+            occupied = self.board
+        pieces = self.pieces[color]
+        return ((PAWN_ATTACKS[color ^ 1][sq] & pieces[Piece.PAWN])
+                | (KNIGHT_ATTACKS[sq] & pieces[Piece.KNIGHT])
+                | (KING_ATTACKS[sq] & pieces[Piece.KING])
+                | (bishop_attacks(sq, occupied) & (pieces[Piece.BISHOP] | pieces[Piece.QUEEN]))
+                | (rook_attacks(sq, occupied) & (pieces[Piece.ROOK] | pieces[Piece.QUEEN])))
+
+    def get_attack_maps(self, color):
+        # Squares attacked by each piece type of the given color, indexed by Piece
+        occupied = self.board
+        pieces = self.pieces[color]
+        attack_maps = [0] * 6
+
+        pawns = pieces[Piece.PAWN]
+        for delta, start_mask in PAWN_CAPTURES[color]:
+            attack_maps[Piece.PAWN] |= shift(pawns & start_mask, delta)
+
+        for piece_type, piece_attacks in ((Piece.KNIGHT, lambda sq: KNIGHT_ATTACKS[sq]),
+                                          (Piece.BISHOP, lambda sq: bishop_attacks(sq, occupied)),
+                                          (Piece.ROOK, lambda sq: rook_attacks(sq, occupied)),
+                                          (Piece.QUEEN, lambda sq: queen_attacks(sq, occupied)),
+                                          (Piece.KING, lambda sq: KING_ATTACKS[sq])):
+            current_pieces = pieces[piece_type]
+            while current_pieces:
+                sq = 64 - current_pieces.bit_length()
+                current_pieces ^= SQUARE_BB[sq]
+                attack_maps[piece_type] |= piece_attacks(sq)
+        return attack_maps
+
+    def get_attack_map(self, color):
+        attack_map = 0
+        for piece_attacks in self.get_attack_maps(color):
+            attack_map |= piece_attacks
+        return attack_map
 
     def get_all_possible_moves(self):
         moves = []
-        current_pieces = self.combined_color[self.color]
-
-        while current_pieces:
-            
-            # Get rightmost set bit 
-            rightmost_piece = current_pieces & np.uint64(~current_pieces+1)
-            # Zero-out rightmost piece -> consider next rightmost piece
-            current_pieces = current_pieces & ~rightmost_piece
-            row, col = self.get_coordinates(rightmost_piece)
-
-            for piece_type in Piece:
-                if self.pieces[self.color][piece_type] & rightmost_piece:
-                    if piece_type == Piece.PAWN:
-                        self.get_pawn_moves(row, col, moves)
-                    elif piece_type == Piece.ROOK:
-                        self.get_rook_moves(row, col, moves)
-                    elif piece_type == Piece.BISHOP:
-                        self.get_bishop_moves(row, col, moves)
-                    elif piece_type == Piece.KNIGHT:
-                        self.get_knight_moves(row, col, moves)
-                    elif piece_type == Piece.KING:
-                        self.get_king_moves(row, col, moves)
-                    elif piece_type == Piece.QUEEN:
-                        self.get_queen_moves(row, col, moves)
+        self.get_piece_moves(FULL_BB, {}, moves)
+        king_sq = square_of(self.pieces[self.color][Piece.KING])
+        self.add_moves(king_sq, KING_ATTACKS[king_sq] & ~self.combined_color[self.color], moves)
         return moves
 
-    def get_pawn_moves(self, r, c, moves):
-        if self.color == Color.WHITE:
-            if r > 0 and not (self.board &  self.get_bit_mask(r-1, c)):
-                moves.append(Move((r,c), (r-1, c)))
-                if r == 6 and not(self.board & self.get_bit_mask(r-2, c)):
-                    moves.append(Move((r,c), (r-2,c)))
-            if r > 0 and c > 0:
-                if self.combined_color[Color.BLACK] & self.get_bit_mask(r-1, c-1):
-                    moves.append(Move((r,c), (r-1, c-1)))
-                elif (r-1, c-1) == self.en_passant_possible and not (self.board &  self.get_bit_mask(r-1, c-1)):
-                    moves.append(Move((r,c), (r-1, c-1), is_en_passant_move=True))
-            if r > 0 and c < 7: 
-                if self.combined_color[Color.BLACK] & self.get_bit_mask(r-1, c+1):
-                    moves.append(Move((r,c), (r-1, c+1)))
-                elif (r-1, c+1) == self.en_passant_possible and not (self.board &  self.get_bit_mask(r-1, c+1)):
-                    moves.append(Move((r,c), (r-1, c+1), is_en_passant_move=True))
+    def get_target_squares(self, quiet, captures):
+        # Squares a non-pawn move may end on: enemy pieces for captures, empty squares for quiet moves
+        targets = self.combined_color[self.color ^ 1] if captures else 0
+        if quiet:
+            targets |= ~self.board & FULL_BB
+        return targets
+
+    def get_piece_moves(self, target_mask, pins, moves, quiet=True, captures=True):
+        # Moves of every piece but the king, restricted to target_mask and, for
+        # pinned pieces, to their pin line. Without quiet moves only captures
+        # and promotions are generated, without captures only the rest.
+        pieces = self.pieces[self.color]
+        targets = self.get_target_squares(quiet, captures) & target_mask
+        occupied = self.board
+
+        self.get_pawn_moves(pieces[Piece.PAWN], target_mask, pins, moves, quiet, captures)
+
+        knights = pieces[Piece.KNIGHT]
+        while knights:
+            sq = 64 - knights.bit_length()
+            knights ^= SQUARE_BB[sq]
+            if sq not in pins:
+                self.add_moves(sq, KNIGHT_ATTACKS[sq] & targets, moves)
+
+        bishops = pieces[Piece.BISHOP]
+        while bishops:
+            sq = 64 - bishops.bit_length()
+            bishops ^= SQUARE_BB[sq]
+            self.add_moves(sq, bishop_attacks(sq, occupied) & targets & pins.get(sq, FULL_BB), moves)
+
+        rooks = pieces[Piece.ROOK]
+        while rooks:
+            sq = 64 - rooks.bit_length()
+            rooks ^= SQUARE_BB[sq]
+            self.add_moves(sq, rook_attacks(sq, occupied) & targets & pins.get(sq, FULL_BB), moves)
+
+        queens = pieces[Piece.QUEEN]
+        while queens:
+            sq = 64 - queens.bit_length()
+            queens ^= SQUARE_BB[sq]
+            self.add_moves(sq, queen_attacks(sq, occupied) & targets & pins.get(sq, FULL_BB), moves)
+
+    def add_moves(self, start, targets, moves):
+        while targets:
+            end = 64 - targets.bit_length()
+            targets ^= SQUARE_BB[end]
+            moves.append(start | end << 6)
+
+    def get_pawn_moves(self, pawns, target_mask, pins, moves, quiet=True, captures=True):
+        # Pawns are moved set-wise: shifting the whole pawn bitboard by the
+        # push/capture delta gives every target square at once
+        empty = ~self.board & FULL_BB
+        push = PAWN_PUSH[self.color]
+
+        single_pushes = shift(pawns, push) & empty
+        if quiet and captures:
+            promotion_mask = FULL_BB
+        elif quiet:
+            promotion_mask = ~PROMOTION_ROW_BB[self.color] & FULL_BB
         else:
-            if r < 7 and not(self.board & self.get_bit_mask(r+1, c)):
-                moves.append(Move((r,c), (r+1,c)))
-                if r == 1 and not (self.board & self.get_bit_mask(r+2, c)):
-                    moves.append(Move((r,c), (r+2,c)))
-            if r < 7 and c > 0:
-                if self.combined_color[Color.WHITE] & self.get_bit_mask(r+1, c-1):
-                    moves.append(Move((r,c), (r+1, c-1)))
-                elif (r+1, c-1) == self.en_passant_possible and not (self.board &  self.get_bit_mask(r+1, c-1)):
-                    moves.append(Move((r,c), (r+1, c-1), is_en_passant_move=True))
-            if r < 7 and c < 7: 
-                if self.combined_color[Color.WHITE] & self.get_bit_mask(r+1, c+1):
-                    moves.append(Move((r,c), (r+1, c+1)))
-                elif (r+1, c+1) == self.en_passant_possible and not (self.board &  self.get_bit_mask(r+1, c+1)):
-                    moves.append(Move((r,c), (r+1, c+1), is_en_passant_move=True))
-
-    def get_rook_moves(self, r, c, moves):
-        directions = [(-1, 0), (0, 1), (1, 0), (0, -1)]
-        self.perform_linear_move(r, c, moves, directions)
-
-    def get_bishop_moves(self, r, c, moves):
-        directions = [(-1, -1), (-1, 1), (1, -1), (1, 1)]
-        self.perform_linear_move(r, c, moves, directions)
-
-    def get_knight_moves(self, r, c, moves):
-        directions = [(1, -2), (1, 2), (-1, -2), (-1, 2), (-2, -1), (-2, 1), (2, -1), (2, 1)]
-        self.perform_single_move(r, c, moves, directions)
-
-    def get_king_moves(self, r, c, moves):
-        directions = [(-1, -1), (-1, 1), (1, -1), (1, 1), (-1, 0), (0, 1), (1, 0), (0, -1)]
-        self.perform_single_move(r, c, moves, directions)
-
-    def get_queen_moves(self, r, c, moves):
-        directions = [(-1, -1), (-1, 1), (1, -1), (1, 1), (-1, 0), (0, 1), (1, 0), (0, -1)]
-        self.perform_linear_move(r, c, moves, directions)
-
-    def perform_linear_move(self, r, c, moves, directions):
-        for dir_r, dir_c in directions:
-            move_r, move_c = r + dir_r, c + dir_c
-            
-            while 0 <= move_r <= 7 and 0 <= move_c <= 7:
-                if self.combined_color[self.color] & self.get_bit_mask(move_r, move_c):
-                    break  
-                moves.append(Move((r, c), (move_r, move_c)))
-                
-                if self.combined_color[~self.color] & self.get_bit_mask(move_r, move_c):
-                    break  
-                
-                move_r += dir_r
-                move_c += dir_c
-    
-    def perform_single_move(self, r, c, moves, directions):
-        for dir_r, dir_c in directions:
-            move_r, move_c = r + dir_r, c + dir_c
-            
-            if 0 <= move_r <= 7 and 0 <= move_c <= 7:
-                if self.combined_color[self.color] & self.get_bit_mask(move_r, move_c):
-                    continue  
-                moves.append(Move((r, c), (move_r, move_c)))
-    
+            promotion_mask = PROMOTION_ROW_BB[self.color]
+        self.add_pawn_moves(single_pushes & target_mask & promotion_mask, push, pins, moves)
+        if quiet:
+            double_pushes = shift(single_pushes & PAWN_DOUBLE_PUSH_ROW_BB[self.color], push) & empty
+            self.add_pawn_moves(double_pushes & target_mask, 2 * push, pins, moves)
+        if not captures:
+            return
+
+        en_passant = SQUARE_BB[self.en_passant_possible[0] * 8 + self.en_passant_possible[1]] if self.en_passant_possible else 0
+        enemy = self.combined_color[self.color ^ 1]
+        for delta, start_mask in PAWN_CAPTURES[self.color]:
+            captures = shift(pawns & start_mask, delta)
+            self.add_pawn_moves(captures & enemy & target_mask, delta, pins, moves)
+            if captures & en_passant:
+                end = 64 - en_passant.bit_length()
+                if self.en_passant_is_legal(end - delta, end):
+                    moves.append((end - delta) | end << 6 | MoveFlag.EN_PASSANT << 12)
+
+    def add_pawn_moves(self, targets, delta, pins, moves):
+        promotion_row = PROMOTION_ROW_BB[self.color]
+        while targets:
+            end = 64 - targets.bit_length()
+            targets ^= SQUARE_BB[end]
+            start = end - delta
+            if start not in pins or pins[start] & SQUARE_BB[end]:
+                if SQUARE_BB[end] & promotion_row:
+                    for flag in PROMOTION_FLAGS:
+                        moves.append(start | end << 6 | flag)
+                else:
+                    moves.append(start | end << 6)
+
+    def en_passant_is_legal(self, start, end):
+        # Both pawns leave their squares at once, which pins and check masks
+        # cannot express, so the resulting position is tested directly
+        captured = end - PAWN_PUSH[self.color]
+        occupied = (self.board ^ SQUARE_BB[start] ^ SQUARE_BB[captured]) | SQUARE_BB[end]
+        king_sq = square_of(self.pieces[self.color][Piece.KING])
+        return not (self.get_attackers(king_sq, self.color ^ 1, occupied) & ~SQUARE_BB[captured])
+
     def get_castle_moves(self, r, c, moves):
         if self.square_under_attack(r, c):
             return # cannot castle while in check
-        if (self.color == Color.WHITE and self.current_castling_rights.wks) or (self.color == Color.BLACK and self.current_castling_rights.bks):
+        if self.castling & (CastlingRight.WKS if self.color == Color.WHITE else CastlingRight.BKS):
             self.get_kingside_castle_moves(r, c, moves, self.color)
-        if (self.color == Color.WHITE and self.current_castling_rights.wqs) or (self.color == Color.BLACK and self.current_castling_rights.bqs):
+        if self.castling & (CastlingRight.WQS if self.color == Color.WHITE else CastlingRight.BQS):
             self.get_queenside_castle_moves(r, c, moves, self.color)
 
 
     def get_kingside_castle_moves(self, r, c, moves, ally_color):
         if not (self.board & self.get_bit_mask(r, c+1)) and not (self.board & self.get_bit_mask(r, c+2)):
             if not self.square_under_attack(r, c + 1) and not self.square_under_attack(r, c + 2):
-                moves.append(Move((r, c), (r, c+2), is_castle_move = True))
+                moves.append(r * 8 + c | (r * 8 + c + 2) << 6 | MoveFlag.CASTLE << 12)
 
     def get_queenside_castle_moves(self, r, c, moves, ally_color):
         if not (self.board & self.get_bit_mask(r, c-1)) and not (self.board & self.get_bit_mask(r, c-2)) and not (self.board & self.get_bit_mask(r, c-3)):
             if not self.square_under_attack(r, c - 1) and not self.square_under_attack(r, c - 2):
-                moves.append(Move((r, c), (r, c-2), is_castle_move = True))
+                moves.append(r * 8 + c | (r * 8 + c - 2) << 6 | MoveFlag.CASTLE << 12)
                 
     def get_bit_mask(self, row, column):
-        bit_mask = np.uint64(1 << (63 - (row * 8 + column)))
-        return bit_mask
+        return SQUARE_BB[row * 8 + column]
 
     def get_coordinates(self, bit_mask):
-        square = (63 - int(np.log2(bit_mask)))
-        row = square // 8
-        col = square % 8
-        return row, col
+        return ROW_COL[64 - bit_mask.bit_length()]
 
     def find_highest_set_bit_position(self, bit_mask):
-        if bit_mask == 0:
-            return -1
-        position = 0
-        while bit_mask:
-            position += 1
-            bit_mask >>= 1
-        return position - 1
+        return bit_mask.bit_length() - 1
 
     def init_board(self):
-        self.pieces[Color.WHITE][Piece.PAWN] = np.uint64(0x000000000000FF00)
-        self.pieces[Color.WHITE][Piece.KNIGHT] = np.uint64(0x0000000000000042)
-        self.pieces[Color.WHITE][Piece.BISHOP] = np.uint64(0x0000000000000024)
-        self.pieces[Color.WHITE][Piece.ROOK] = np.uint64(0x0000000000000081)
-        self.pieces[Color.WHITE][Piece.KING] = np.uint64(0x0000000000000008)
-        self.pieces[Color.WHITE][Piece.QUEEN] = np.uint64(0x0000000000000010)
-
-        self.pieces[Color.BLACK][Piece.PAWN] = np.uint64(0x00FF000000000000)
-        self.pieces[Color.BLACK][Piece.KNIGHT] = np.uint64(0x4200000000000000)
-        self.pieces[Color.BLACK][Piece.BISHOP] = np.uint64(0x2400000000000000)
-        self.pieces[Color.BLACK][Piece.ROOK] = np.uint64(0x8100000000000000)
-        self.pieces[Color.BLACK][Piece.KING] = np.uint64(0x0800000000000000)
-        self.pieces[Color.BLACK][Piece.QUEEN] = np.uint64(0x1000000000000000)
-    
-        for p in Piece:
-            for c in Color:
+        self.pieces[Color.WHITE][Piece.PAWN] = 0x000000000000FF00
+        self.pieces[Color.WHITE][Piece.KNIGHT] = 0x0000000000000042
+        self.pieces[Color.WHITE][Piece.BISHOP] = 0x0000000000000024
+        self.pieces[Color.WHITE][Piece.ROOK] = 0x0000000000000081
+        self.pieces[Color.WHITE][Piece.KING] = 0x0000000000000008
+        self.pieces[Color.WHITE][Piece.QUEEN] = 0x0000000000000010
+
+        self.pieces[Color.BLACK][Piece.PAWN] = 0x00FF000000000000
+        self.pieces[Color.BLACK][Piece.KNIGHT] = 0x4200000000000000
+        self.pieces[Color.BLACK][Piece.BISHOP] = 0x2400000000000000
+        self.pieces[Color.BLACK][Piece.ROOK] = 0x8100000000000000
+        self.pieces[Color.BLACK][Piece.KING] = 0x0800000000000000
+        self.pieces[Color.BLACK][Piece.QUEEN] = 0x1000000000000000
+        self.update_occupancy()
+
+    def snapshot(self):
+        # Compact, picklable description of the position (no move history):
+        # (12 piece bitboards, side to move, castling rights, en passant square,
+        # halfmove clock, keys of the positions it can repeat)
+        return (tuple(self.pieces[Color.WHITE] + self.pieces[Color.BLACK]), int(self.color),
+                self.castling, self.en_passant_possible, self.halfmove_clock, tuple(self.get_recent_keys()))
+
+    @classmethod
+    def from_fen(cls, fen):
+        # Position from Forsyth-Edwards Notation; raises ValueError on malformed
+        # or impossible positions
+        fields = fen.split()
+        if len(fields) not in (4, 6):
+            raise ValueError(f"FEN needs 4 or 6 fields, got {len(fields)}: {fen!r}")
+        placement, color, castling, en_passant = fields[:4]
+        gs = cls()
+
+        ranks = placement.split('/')
+        if len(ranks) != 8:
+            raise ValueError(f"FEN placement needs 8 ranks, got {len(ranks)}")
+        for row, rank in enumerate(ranks):
+            col = 0
+            for char in rank:
+                if char in '12345678':
+                    col += int(char)
+                elif char.lower() in FEN_PIECES and col < 8:
+                    piece_color = Color.WHITE if char.isupper() else Color.BLACK
+                    gs.pieces[piece_color][FEN_PIECES[char.lower()]] |= SQUARE_BB[row * 8 + col]
+                    col += 1
+                else:
+                    raise ValueError(f"bad FEN rank {rank!r}")
+            if col != 8:
+                raise ValueError(f"FEN rank {rank!r} does not have 8 squares")
+        for c in Color:
+            if popcount(gs.pieces[c][Piece.KING]) != 1:
+                raise ValueError(f"FEN needs exactly one {c.name.lower()} king")
+            if gs.pieces[c][Piece.PAWN] & (PROMOTION_ROW_BB[Color.WHITE] | PROMOTION_ROW_BB[Color.BLACK]):
+                raise ValueError("FEN has a pawn on the first or last rank")
+
+        if color not in ('w', 'b'):
+            raise ValueError(f"bad FEN side to move {color!r}")
+        gs.color = Color.WHITE if color == 'w' else Color.BLACK
+
+        gs.castling = 0
+        if castling != '-':
+            for char in castling:
+                if char not in FEN_CASTLING or gs.castling & FEN_CASTLING[char]:
+                    raise ValueError(f"bad FEN castling rights {castling!r}")
+                right = FEN_CASTLING[char]
+                rights_color, king_sq, rook_sq = CASTLING_SQUARES[right]
+                if not (gs.pieces[rights_color][Piece.KING] & SQUARE_BB[king_sq]
+                        and gs.pieces[rights_color][Piece.ROOK] & SQUARE_BB[rook_sq]):
+                    raise ValueError(f"FEN castling right {char!r} without king and rook on their squares")
+                gs.castling |= right
+
+        if en_passant != '-':
+            if (len(en_passant) != 2 or en_passant[0] not in Move.files_to_cols
+                    or en_passant[1] != ('6' if gs.color == Color.WHITE else '3')):
+                raise ValueError(f"bad FEN en passant square {en_passant!r}")
+            gs.en_passant_possible = (Move.ranks_to_rows[en_passant[1]], Move.files_to_cols[en_passant[0]])
+
+        if len(fields) == 6:
+            if not (fields[4].isdigit() and fields[5].isdigit() and int(fields[5]) > 0):
+                raise ValueError(f"bad FEN move counters {fields[4]!r} {fields[5]!r}")
+            gs.halfmove_clock = int(fields[4])
+            gs.first_move_number = int(fields[5])
+
+        gs.update_occupancy()
+        if gs.is_square_attacked(square_of(gs.pieces[gs.color ^ 1][Piece.KING]), gs.color):
+            raise ValueError("FEN side not to move is in check")
+        return gs
+
+    def get_fen(self):
+        ranks = []
+        for row in range(8):
+            rank = ''
+            empty = 0
+            for col in range(8):
+                sq = row * 8 + col
+                piece = self.mailbox[sq]
+                if piece is None:
+                    empty += 1
+                    continue
+                if empty:
+                    rank += str(empty)
+                    empty = 0
+                letter = PieceMapping.piece_mapping[piece].lower()
+                rank += letter.upper() if self.combined_color[Color.WHITE] & SQUARE_BB[sq] else letter
+            ranks.append(rank + (str(empty) if empty else ''))
+
+        castling = ''.join(char for char, right in FEN_CASTLING.items() if self.castling & right) or '-'
+        if self.en_passant_possible:
+            en_passant = Move.cols_to_files[self.en_passant_possible[1]] + Move.rows_to_ranks[self.en_passant_possible[0]]
+        else:
+            en_passant = '-'
+        return f"{'/'.join(ranks)} {'wb'[self.color]} {castling} {en_passant} {self.halfmove_clock} {self.get_fullmove_number()}"
+
+    def get_fullmove_number(self):
+        # The number goes up after every black move
+        start_color = self.color ^ (len(self.move_log) & 1)
+        return self.first_move_number + (len(self.move_log) + start_color) // 2
+
+    def get_san(self, move):
+        # Standard algebraic notation of a legal move code in the current position
+        start = move & 63
+        end = move >> 6 & 63
+        flag = move >> 12 & 15
+        piece = self.mailbox[start]
+        view = Move.from_code(move)
+        end_square = view.get_rank_file(view.end_row, view.end_col)
+        is_capture = self.mailbox[end] is not None or flag == MoveFlag.EN_PASSANT
+        saved_check, saved_pins = self.check, self.pins
+
+        if flag == MoveFlag.CASTLE:
+            san = "O-O" if view.end_col == 6 else "O-O-O"
+        elif piece == Piece.PAWN:
+            san = (Move.cols_to_files[view.start_col] + "x" if is_capture else "") + end_square
+            if flag >= MoveFlag.PROMOTE_KNIGHT:
+                san += "=" + PieceMapping.piece_mapping[view.promotion_piece]
+        else:
+            # Another piece of the same type reaching the same square needs the
+            # start file, rank or both to tell the two apart
+            rivals = [other & 63 for other in self.generate_legal_moves()
+                      if other >> 6 & 63 == end and other & 63 != start and self.mailbox[other & 63] == piece]
+            disambiguation = ""
+            if rivals:
+                if all(sq & 7 != start & 7 for sq in rivals):
+                    disambiguation = Move.cols_to_files[view.start_col]
+                elif all(sq >> 3 != start >> 3 for sq in rivals):
+                    disambiguation = Move.rows_to_ranks[view.start_row]
+                else:
+                    disambiguation = view.get_rank_file(view.start_row, view.start_col)
+            san = PieceMapping.piece_mapping[piece].upper() + disambiguation + ("x" if is_capture else "") + end_square
+
+        self.make_move(move)
+        if self.in_check():
+            san += "+" if self.generate_legal_moves() else "#"
+        self.undo_move()
+        self.check, self.pins = saved_check, saved_pins
+        return san
+
+    def parse_san(self, san):
+        # Legal move code for a move in standard algebraic notation; raises ValueError
+        # if san is not a legal move here. Check marks and annotations are ignored.
+        text = san.rstrip("+#!?")
+        moves = self.generate_legal_moves()
+        if text in ("O-O", "0-0", "O-O-O", "0-0-0"):
+            end_col = 6 if len(text) == 3 else 2
+            for move in moves:
+                if move >> 12 & 15 == MoveFlag.CASTLE and move >> 6 & 7 == end_col:
+                    return move
+            raise ValueError(f"illegal move {san!r}")
+
+        promotion = None
+        if "=" in text:
+            text, promotion_letter = text.split("=")
+            promotion = FEN_PIECES.get(promotion_letter.lower())
+        piece = FEN_PIECES[text[0].lower()] if text[:1] in ("N", "B", "R", "Q", "K") else Piece.PAWN
+        if piece != Piece.PAWN:
+            text = text[1:]
+        text = text.replace("x", "")
+        if len(text) < 2 or text[-2] not in Move.files_to_cols or text[-1] not in Move.ranks_to_rows:
+            raise ValueError(f"bad move {san!r}")
+        end = Move.ranks_to_rows[text[-1]] * 8 + Move.files_to_cols[text[-2]]
+        disambiguation = text[:-2]
+
+        for move in moves:
+            start = move & 63
+            flag = move >> 12 & 15
+            if move >> 6 & 63 != end or self.mailbox[start] != piece:
+                continue
+            if (flag - 3 if flag >= MoveFlag.PROMOTE_KNIGHT else None) != promotion:
+                continue
+            view = Move.from_code(move)
+            if disambiguation and not view.get_rank_file(view.start_row, view.start_col).startswith(disambiguation) \
+                    and view.rows_to_ranks[view.start_row] != disambiguation:
+                continue
+            return move
+        raise ValueError(f"illegal move {san!r}")
+
+    def pack(self):
+        # Fixed-size binary form of the position (PACKED_FORMAT.size bytes), see unpack
+        nibbles = bytearray(16)
+        occupied = self.board
+        index = 0
+        while occupied:
+            sq = 64 - occupied.bit_length()
+            occupied ^= SQUARE_BB[sq]
+            code = self.mailbox[sq] + (6 if self.combined_color[Color.BLACK] & SQUARE_BB[sq] else 0)
+            nibbles[index >> 1] |= code << 4 if not index & 1 else code
+            index += 1
+        en_passant = self.en_passant_possible[0] * 8 + self.en_passant_possible[1] if self.en_passant_possible else NO_SQUARE
+        return PACKED_FORMAT.pack(self.board, bytes(nibbles), self.color | self.castling << 1, en_passant,
+                                  self.halfmove_clock, self.get_fullmove_number())
+
+    @classmethod
+    def unpack(cls, data):
+        occupied, nibbles, flags, en_passant, halfmove_clock, fullmove_number = PACKED_FORMAT.unpack(data)
+        gs = cls()
+        index = 0
+        while occupied:
+            sq = 64 - occupied.bit_length()
+            occupied ^= SQUARE_BB[sq]
+            code = nibbles[index >> 1] >> 4 if not index & 1 else nibbles[index >> 1] & 0xF
+            gs.pieces[code // 6][code % 6] |= SQUARE_BB[sq]
+            index += 1
+        gs.color = Color(flags & 1)
+        gs.castling = flags >> 1
+        gs.en_passant_possible = ROW_COL[en_passant] if en_passant != NO_SQUARE else ()
+        gs.halfmove_clock = halfmove_clock
+        gs.first_move_number = fullmove_number
+        gs.update_occupancy()
+        return gs
+
+    @classmethod
+    def from_snapshot(cls, state):
+        piece_bitboards, color, castling, en_passant_possible, halfmove_clock, recent_keys = state
+        gs = cls()
+        gs.pieces = [list(piece_bitboards[:6]), list(piece_bitboards[6:])]
+        gs.color = Color(color)
+        gs.castling = castling
+        gs.en_passant_possible = tuple(en_passant_possible)
+        gs.halfmove_clock = halfmove_clock
+        gs.key_history = list(recent_keys)
+        gs.update_occupancy()
+        return gs
+
+    def update_occupancy(self):
+        # Rebuilds combined_color, board, mailbox, the zobrist key and the evaluation totals
+        # from scratch after the position is set directly
+        self.combined_color = [0, 0]
+        self.mailbox = [None] * 64
+        for c in Color:
+            for p in Piece:
                 self.combined_color[c] |= self.pieces[c][p]
-        
+                current_pieces = self.pieces[c][p]
+                while current_pieces:
+                    sq = 64 - current_pieces.bit_length()
+                    current_pieces ^= SQUARE_BB[sq]
+                    self.mailbox[sq] = p
         self.board = self.combined_color[Color.WHITE] | self.combined_color[Color.BLACK]
+        self.zobrist_key = compute_hash(self)
+        self.mg_score, self.eg_score, self.phase = compute_scores(self)
     
 
 
@@ -420,8 +835,18 @@ class CastleRights:
         self.bqs = bqs
 
 
+def move_identity(code):
+    # From/to squares plus the promotion flag; castling and en passant follow from the squares
+    flag = code >> 12 & 15
+    return code & 0xFFF | (flag << 12 if flag >= MoveFlag.PROMOTE_KNIGHT else 0)
+
 
 class Move():
+    # Thin view over a move code, the int the generator, search and move_log use:
+    # start square in bits 0-5, end square in bits 6-11 and a MoveFlag in bits
+    # 12-15. move_log codes also hold the moved piece + 1 in bits 16-18 and the
+    # captured piece + 1 in bits 19-21 (0 for none), which notation needs.
+    __slots__ = ("move_ID",)
 
     ranks_to_rows = {"1" : 7, "2" : 6, "3" : 5, "4" : 4,
                      "5" : 3, "6" : 2, "7" : 1, "8" : 0}
@@ -430,27 +855,90 @@ class Move():
                      "e" : 4, "f" : 5, "g" : 6, "h" : 7}
     cols_to_files = {v:k for k, v in files_to_cols.items()}
 
-    def __init__(self, start_sq, end_sq, is_en_passant_move = False, is_castle_move = False):
-        self.start_row = start_sq[0]
-        self.start_col = start_sq[1]
-        self.end_row = end_sq[0]
-        self.end_col = end_sq[1]
-        self.piece_moved = 1 << (63 - (self.start_row * 8 + self.start_col))
-        self.piece_captured = 1 << (63 - (self.end_row * 8 + self.end_col))
-        self.move_ID = self.start_row * 1000 + self.start_col * 100 + self.end_row * 10 + self.end_col
-        self.is_capture = False
-        self.captured_piece_type = None
-        self.moved_piece_type = None
-        self.moved_piece_color = None
-        self.is_pawn_promotion = False 
-        self.is_en_passant_move = is_en_passant_move
-        self.is_castle_move = is_castle_move
-
+    def __init__(self, start_sq, end_sq, is_en_passant_move = False, is_castle_move = False, promotion_piece = None):
+        flag = MoveFlag.NONE
+        if is_en_passant_move:
+            flag = MoveFlag.EN_PASSANT
+        elif is_castle_move:
+            flag = MoveFlag.CASTLE
+        elif promotion_piece is not None:
+            flag = promotion_piece + 3
+        self.move_ID = start_sq[0] * 8 + start_sq[1] | (end_sq[0] * 8 + end_sq[1]) << 6 | flag << 12
+
+    @classmethod
+    def from_code(cls, code):
+        move = cls.__new__(cls)
+        move.move_ID = code
+        return move
+
+    @property
+    def start_row(self):
+        return (self.move_ID & 63) >> 3
+
+    @property
+    def start_col(self):
+        return self.move_ID & 7
+
+    @property
+    def end_row(self):
+        return (self.move_ID >> 6 & 63) >> 3
+
+    @property
+    def end_col(self):
+        return self.move_ID >> 6 & 7
+
+    @property
+    def piece_moved(self):
+        return SQUARE_BB[self.move_ID & 63]
+
+    @property
+    def piece_captured(self):
+        return SQUARE_BB[self.move_ID >> 6 & 63]
+
+    @property
+    def is_en_passant_move(self):
+        return self.move_ID >> 12 & 15 == MoveFlag.EN_PASSANT
+
+    @property
+    def is_castle_move(self):
+        return self.move_ID >> 12 & 15 == MoveFlag.CASTLE
+
+    @property
+    def is_pawn_promotion(self):
+        return self.move_ID >> 12 & 15 >= MoveFlag.PROMOTE_KNIGHT
+
+    @property
+    def promotion_piece(self):
+        flag = self.move_ID >> 12 & 15
+        return Piece(flag - 3) if flag >= MoveFlag.PROMOTE_KNIGHT else None
+
+    # Known only for moves taken from move_log
+    @property
+    def moved_piece_type(self):
+        piece = self.move_ID >> 16 & 7
+        return Piece(piece - 1) if piece else None
+
+    @property
+    def captured_piece_type(self):
+        piece = self.move_ID >> 19 & 7
+        return Piece(piece - 1) if piece else None
+
+    @property
+    def is_capture(self):
+        return bool(self.move_ID >> 19 & 7)
 
     def __eq__(self, other):
+        # Compares the squares and the promotion piece only, so a move_log code
+        # equals the generated one and a clicked Move(start, end) equals the
+        # generated castle or en passant code
         if isinstance(other, Move):
-            return self.move_ID == other.move_ID
-        return False 
+            other = other.move_ID
+        elif not isinstance(other, int):
+            return False
+        return move_identity(self.move_ID) == move_identity(other)
+
+    def __hash__(self):
+        return hash(move_identity(self.move_ID))
     
     def __str__(self):
         if self.is_castle_move:
@@ -461,7 +949,7 @@ class Move():
             if self.is_capture:
                 return PieceMapping.piece_mapping[self.captured_piece_type].upper() + "x" + end_square
             elif self.is_pawn_promotion:
-                return end_square + "=Q" # default queen
+                return end_square + "=" + PieceMapping.piece_mapping[self.promotion_piece]
             else:
                 return end_square
         else:
@@ -469,14 +957,11 @@ class Move():
             capture_symbol = "x" if self.is_capture else ""
             return piece_letter + capture_symbol + end_square
 
-    def check_pawn_promotion(self):
-        if (self.moved_piece_type == Piece.PAWN and self.moved_piece_color == Color.WHITE and self.end_row == 0) or (self.moved_piece_type == Piece.PAWN and self.moved_piece_color == Color.BLACK and self.end_row == 7):
-            self.is_pawn_promotion = True
-
     def get_chess_notation(self):
-        return self.get_rank_file(self.start_row, self.start_col) + self.get_rank_file(self.end_row, self.end_col)
+        notation = self.get_rank_file(self.start_row, self.start_col) + self.get_rank_file(self.end_row, self.end_col)
+        if self.promotion_piece is not None:
+            notation += PieceMapping.piece_mapping[self.promotion_piece].lower()
+        return notation
 
     def get_rank_file(self, r, c):
         return self.cols_to_files[c] + self.rows_to_ranks[r]
-
-    
@@ -45,6 +45,30 @@ class Piece(IntEnum):
     KING = 5
 
 
+class CastlingRight(IntEnum):
+    WKS = 1
+    WQS = 2
+    BKS = 4
+    BQS = 8
+
+
+class MoveFlag(IntEnum):
+    # Bits 12-15 of a move code; a promotion flag is the promoted Piece + 3
+    NONE = 0
+    EN_PASSANT = 1
+    CASTLE = 2
+    PROMOTE_KNIGHT = 4
+    PROMOTE_BISHOP = 5
+    PROMOTE_ROOK = 6
+    PROMOTE_QUEEN = 7
+
+
+class Bound(IntEnum):
+    EXACT = 0
+    LOWER = 1
+    UPPER = 2
+
+
 class PieceMapping:
 
     piece_mapping = {
@@ -1,5 +1,4 @@
-import ChessEngine, AIMoveFinder
-import numpy as np
+import ChessEngine, AIMoveFinder, OpeningBook, Tablebase
 import os
 os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = '1' # don't display pygame prompt
 import pygame as p
@@ -13,6 +12,10 @@ MOVE_LOG_PANEL_HEIGHT = BOARD_HEIGHT
 DIMENSION = 8 # 8x8 chessboard
 SQ_SIZE = BOARD_HEIGHT // DIMENSION
 MAX_FPS = 15
+AI_TIME_LIMIT_MS = 1000
+AI_PONDER = True # let the AI think on the human's time
+BOOK_PATH = "book.bin" # opening book used by the AI when the file exists
+TABLEBASE_PATH = "tablebases" # endgame tables used by the AI when the directory exists
 IMAGES = {}
 
 def load_images():
@@ -27,7 +30,8 @@ def main():
     screen.fill(p.Color("white"))
     gs = ChessEngine.ChessBoard()
     move_log_font = p.font.SysFont("Arial", 15, False, False)
-    ai = AIMoveFinder.AIMoveFinder()
+    ai = AIMoveFinder.AIMoveFinder(book=OpeningBook.OpeningBook(BOOK_PATH) if os.path.exists(BOOK_PATH) else None,
+                                   tablebase=Tablebase.Tablebase(TABLEBASE_PATH) if os.path.isdir(TABLEBASE_PATH) else None)
     gs.init_board()
     valid_moves = gs.get_valid_moves()
     move_made = False
@@ -36,14 +40,26 @@ def main():
     player_two = Player.HUMAN # player two corresponds to black
 
     load_images()
+    renderer = BoardRenderer(screen, move_log_font)
     running = True
     sqSelected = ()
     playerClicks = []
+    ai_search = None # background search of the AI, while it is thinking
+    ai_ponder = None # background search of the AI, while the human is thinking
     while running:
         human_turn = (gs.color == Color.WHITE and player_one == Player.HUMAN) or (gs.color == Color.BLACK and player_two == Player.HUMAN) # 0-Human, 1-AI
         for e in p.event.get():
             if e.type == p.QUIT:
                 running = False
+                if ai_search:
+                    ai_search.cancel()
+                    ai_search = None
+                if ai_ponder:
+                    ai_ponder.cancel()
+                    ai_ponder = None
+            elif e.type in (p.WINDOWEXPOSED, p.VIDEOEXPOSE):
+                # the window was covered or restored: only dirty rects are sent, so repaint everything
+                renderer.full_redraw = True
             elif e.type == p.MOUSEBUTTONDOWN:
                 if not game_over and human_turn:
                     location = p.mouse.get_pos() # (x, y) location of mouse
@@ -57,9 +73,18 @@ def main():
                         playerClicks.append(sqSelected)
                     if len(playerClicks) == 2: # second click -> move 
                         move = ChessEngine.Move(playerClicks[0], playerClicks[1])
+                        start_r, start_c = playerClicks[0]
+                        if gs.mailbox[start_r * 8 + start_c] == Piece.PAWN and playerClicks[1][0] in (0, 7):
+                            move = ChessEngine.Move(playerClicks[0], playerClicks[1], promotion_piece=Piece.QUEEN) # auto-queen
                         print(move.get_chess_notation())
                         for i in range(len(valid_moves)):
                             if move == valid_moves[i]:
+                                if ai_ponder:
+                                    if ai_ponder.ponder_move == valid_moves[i]: # ponder hit, the search goes on
+                                        ai_search = ai.ponder_hit(ai_ponder, AI_TIME_LIMIT_MS)
+                                    else:
+                                        ai_ponder.cancel()
+                                    ai_ponder = None
                                 gs.make_move(valid_moves[i])
                                 move_made = True
                                 sqSelected = () # reset user clicks
@@ -68,15 +93,31 @@ def main():
                             playerClicks = [sqSelected]
             elif e.type == p.KEYDOWN:
                 if e.key == p.K_r:
+                    if ai_search:
+                        ai_search.cancel()
+                        ai_search = None
+                    if ai_ponder:
+                        ai_ponder.cancel()
+                        ai_ponder = None
                     gs.undo_move() 
                     move_made = True
                     game_over = False
 
-        # AI moves
-        if not game_over and not human_turn:
-            best_move = ai.find_best_move(gs, valid_moves)
-            gs.make_move(best_move)
-            move_made = True
+        # AI moves: the search runs in the background and is polled every frame
+        if running and not game_over and not human_turn and not move_made:
+            if ai_search is None:
+                ai_search = ai.start_search(gs, time_limit_ms=AI_TIME_LIMIT_MS)
+            elif ai_search.done():
+                best_move = ai_search.result()
+                ai_search = None
+                for move in valid_moves:
+                    if move == best_move:
+                        gs.make_move(move)
+                        move_made = True
+                        break
+                human_next = (gs.color == Color.WHITE and player_one == Player.HUMAN) or (gs.color == Color.BLACK and player_two == Player.HUMAN)
+                if AI_PONDER and move_made and human_next:
+                    ai_ponder = ai.start_ponder(gs)
 
         if move_made:
             score = ai.score_material(gs.pieces)
@@ -84,7 +125,12 @@ def main():
             valid_moves = gs.get_valid_moves()
             move_made = False
 
-        draw_game_state(playerClicks, valid_moves, screen, gs, move_log_font)
+        status_text = ""
+        if ai_search and not game_over:
+            status_text = get_thinking_text("Thinking...", ai_search.info)
+        elif ai_ponder:
+            status_text = get_thinking_text("Pondering...", ai_ponder.info)
+        dirty_rects = renderer.draw(gs, playerClicks, valid_moves, status_text)
 
         if not game_over:
             if gs.check_mate:
@@ -93,76 +139,172 @@ def main():
             elif gs.stale_mate:
                 game_over = True
                 print(f"Draw by stalemate!")
+            elif gs.is_repetition(2):
+                game_over = True
+                print(f"Draw by threefold repetition!")
+            elif gs.is_fifty_move_draw():
+                game_over = True
+                print(f"Draw by the fifty-move rule!")
 
 
 
         clock.tick(MAX_FPS)
-        p.display.flip()
-
-
-def draw_game_state(playerClicks, valid_moves, screen, gs, move_log_font):
-    draw_board(screen)
-    if len(playerClicks) == 1:
-        highlight_possible_positions(playerClicks, valid_moves, screen, gs)
-    draw_pieces(screen, gs)
-    draw_move_log(screen, gs, move_log_font)
-
-def draw_move_log(screen, gs, font):
-    move_log_rectangle = p.Rect(BOARD_WIDTH, 0, MOVE_LOG_PANEL_WIDTH, MOVE_LOG_PANEL_HEIGHT)
-    p.draw.rect(screen, p.Color("#36454F"), move_log_rectangle)
-    move_log = gs.move_log
-    padding = 5
-    move_texts = []
-    moves_per_row = 3
-
-    for i in range(0, len(move_log), 2):
-        move_string = str(i//2 + 1) + ". " + str(move_log[i]) + " "
-        if i+1 < len(move_log):
-            move_string  += str(move_log[i+1]) + " "
-        move_texts.append(move_string)
-
-
-    space_text = padding
-    for i in range(0, len(move_texts), moves_per_row):
-        text = ""
-        for j in range(moves_per_row):
-            if i + j < len(move_texts):
-                text += move_texts[i+j]
-        text_obj = font.render(text, True, p.Color('white'))
-        text_location = move_log_rectangle.move(padding, space_text)
-        screen.blit(text_obj, text_location)
-        space_text += text_obj.get_height()
-
-def highlight_possible_positions(playerClicks, valid_moves, screen, gs):
-    valid_moves_for_piece = []
+        p.display.update(dirty_rects)
+
+
+PIECE_IMAGE_KEYS = {
+    (Color.WHITE, Piece.PAWN): 'wp',
+    (Color.WHITE, Piece.ROOK): 'wR',
+    (Color.WHITE, Piece.KNIGHT): 'wN',
+    (Color.WHITE, Piece.BISHOP): 'wB',
+    (Color.WHITE, Piece.QUEEN): 'wQ',
+    (Color.WHITE, Piece.KING): 'wK',
+    (Color.BLACK, Piece.PAWN): 'bp',
+    (Color.BLACK, Piece.ROOK): 'bR',
+    (Color.BLACK, Piece.KNIGHT): 'bN',
+    (Color.BLACK, Piece.BISHOP): 'bB',
+    (Color.BLACK, Piece.QUEEN): 'bQ',
+    (Color.BLACK, Piece.KING): 'bK',
+}
+MOVE_LOG_COLOR = p.Color("#36454F")
+MOVES_PER_LOG_LINE = 3 # full moves per line of the move log
+MOVE_LOG_PADDING = 5
+
+
+class BoardRenderer:
+    # Draws the game incrementally. The board and its labels are rendered once,
+    # move log lines once each, and every frame only the squares whose piece or
+    # highlight changed are blitted again; draw() returns the changed rectangles
+    # for p.display.update, so the cost of a frame does not grow with the game.
+    def __init__(self, screen, font):
+        self.screen = screen
+        self.font = font
+        self.board_surface = render_board()
+        self.selection_surface = p.Surface((SQ_SIZE, SQ_SIZE))
+        self.selection_surface.set_alpha(70)
+        self.selection_surface.fill(p.Color('grey'))
+        self.squares = [None] * 64 # (image key, highlight) last drawn on every square
+        self.log_moves = [] # move_log codes shown by log_lines
+        self.log_lines = [] # rendered move log lines
+        self.status_text = None
+        self.full_redraw = True
+
+    def draw(self, gs, playerClicks, valid_moves, status_text=""):
+        dirty = []
+        if self.full_redraw:
+            dirty.append(self.screen.get_rect())
+
+        highlights = get_highlights(playerClicks, valid_moves, gs)
+        for square in range(64):
+            piece = gs.mailbox[square]
+            if piece is not None:
+                color = Color.WHITE if gs.combined_color[Color.WHITE] & (1 << (63 - square)) else Color.BLACK
+                state = (PIECE_IMAGE_KEYS[(color, piece)], highlights.get(square))
+            else:
+                state = (None, highlights.get(square))
+            if state != self.squares[square] or self.full_redraw:
+                self.squares[square] = state
+                dirty.append(self.draw_square(square, *state))
+
+        log_changed = self.update_move_log(gs.move_log) or self.full_redraw
+        if log_changed or (self.status_text and not status_text):
+            dirty.append(self.draw_move_log())
+        if status_text and (status_text != self.status_text or log_changed):
+            dirty.append(self.draw_status(status_text))
+        self.status_text = status_text
+
+        self.full_redraw = False
+        return dirty
+
+    def draw_square(self, square, image_key, highlight):
+        row, column = square // 8, square % 8
+        rect = p.Rect(column * SQ_SIZE, row * SQ_SIZE, SQ_SIZE, SQ_SIZE)
+        self.screen.blit(self.board_surface, rect, rect)
+
+        center = (rect.x + SQ_SIZE//2, rect.y + SQ_SIZE//2)
+        if highlight == "selected":
+            self.screen.blit(self.selection_surface, rect)
+        elif highlight == "capture":
+            p.draw.circle(self.screen, p.Color('grey'), center, SQ_SIZE//2.5, 8)
+        elif highlight == "move":
+            p.draw.circle(self.screen, p.Color('grey'), center, SQ_SIZE//6)
+
+        if image_key in IMAGES:
+            self.screen.blit(IMAGES[image_key], rect)
+        return rect
+
+    def update_move_log(self, move_log):
+        # Re-renders the log lines from the first move that differs from the
+        # cached ones (only the tail changes on a move or an undo). Returns
+        # True if anything changed.
+        common = min(len(self.log_moves), len(move_log))
+        while common and self.log_moves[common - 1] != move_log[common - 1]:
+            common -= 1
+        if common == len(self.log_moves) == len(move_log):
+            return False
+
+        plies_per_line = 2 * MOVES_PER_LOG_LINE
+        first_line = common // plies_per_line
+        self.log_moves = list(move_log)
+        del self.log_lines[first_line:]
+        for line_start in range(first_line * plies_per_line, len(move_log), plies_per_line):
+            text = ""
+            for i in range(line_start, min(line_start + plies_per_line, len(move_log)), 2):
+                text += str(i//2 + 1) + ". " + str(ChessEngine.Move.from_code(move_log[i])) + " "
+                if i+1 < len(move_log):
+                    text += str(ChessEngine.Move.from_code(move_log[i+1])) + " "
+            self.log_lines.append(self.font.render(text, True, p.Color('white')))
+        return True
+
+    def draw_move_log(self):
+        move_log_rectangle = p.Rect(BOARD_WIDTH, 0, MOVE_LOG_PANEL_WIDTH, MOVE_LOG_PANEL_HEIGHT)
+        p.draw.rect(self.screen, MOVE_LOG_COLOR, move_log_rectangle)
+        space_text = MOVE_LOG_PADDING
+        for text_obj in self.log_lines:
+            self.screen.blit(text_obj, move_log_rectangle.move(MOVE_LOG_PADDING, space_text))
+            space_text += text_obj.get_height()
+        return move_log_rectangle
+
+    def draw_status(self, text):
+        # One line at the bottom of the move log panel, e.g. the AI's search progress
+        height = self.font.get_linesize() + MOVE_LOG_PADDING
+        rect = p.Rect(BOARD_WIDTH, MOVE_LOG_PANEL_HEIGHT - height, MOVE_LOG_PANEL_WIDTH, height)
+        p.draw.rect(self.screen, MOVE_LOG_COLOR, rect)
+        if text:
+            self.screen.blit(self.font.render(text, True, p.Color('white')), (rect.x + MOVE_LOG_PADDING, rect.y))
+        return rect
+
+def get_thinking_text(text, info):
+    if info.get("depth"):
+        text += f" depth {info['depth']}, score {info['score']}"
+    return text
+
+def get_highlights(playerClicks, valid_moves, gs):
+    # Maps the selected square and the squares its piece can move to onto how they are highlighted
+    highlights = {}
+    if len(playerClicks) != 1:
+        return highlights
     start_r, start_c = playerClicks[0][0], playerClicks[0][1]
-    for move in valid_moves:
-        if start_r == move.start_row and start_c == move.start_col:
-            valid_moves_for_piece.append((move))
     
     # White is 0, black is 1 
     # Only allow to select a piece if it's current color's turn
-    if gs.combined_color[gs.color] & np.uint64(1 << (63 - (start_r * 8 + start_c))):
-        s = p.Surface((SQ_SIZE, SQ_SIZE))
-        s.set_alpha(70)
-        s.fill(p.Color('grey'))
-        screen.blit(s, (start_c * SQ_SIZE, start_r * SQ_SIZE))
-
-    for move in valid_moves_for_piece:
-        end_r, end_c = move.end_row, move.end_col
-        center_x = end_c * SQ_SIZE + SQ_SIZE//2
-        center_y = end_r * SQ_SIZE + SQ_SIZE//2
-
-        # if capture possible
-        if gs.combined_color[~gs.color] & np.uint64(1 << (63 - (end_r * 8 + end_c))):
-            p.draw.circle(screen, p.Color('grey'), (center_x, center_y), SQ_SIZE//2.5, 8)
-        elif move.is_en_passant_move:
-            p.draw.circle(screen, p.Color('grey'), (center_x, center_y), SQ_SIZE//2.5, 8)
-        else:
-            p.draw.circle(screen, p.Color('grey'), (center_x, center_y), SQ_SIZE//6)
-      
-
-def draw_board(screen):
+    if gs.combined_color[gs.color] & (1 << (63 - (start_r * 8 + start_c))):
+        highlights[start_r * 8 + start_c] = "selected"
+
+    for code in valid_moves:
+        move = ChessEngine.Move.from_code(code)
+        if start_r == move.start_row and start_c == move.start_col:
+            end_square = move.end_row * 8 + move.end_col
+            # if capture possible
+            if gs.combined_color[~gs.color] & (1 << (63 - end_square)) or move.is_en_passant_move:
+                highlights[end_square] = "capture"
+            else:
+                highlights[end_square] = "move"
+    return highlights
+
+def render_board():
+    # The squares with their rank and file labels, drawn once and reused every frame
+    surface = p.Surface((BOARD_WIDTH, BOARD_HEIGHT))
     colors = [p.Color(184,139,74), p.Color(227,193,111)]
     # colors = [p.Color(118, 150, 86), p.Color(238, 238, 210)]
 
@@ -178,47 +320,18 @@ def draw_board(screen):
             color = colors[(row+column + 1) % 2]
             x = column * SQ_SIZE
             y = row * SQ_SIZE
-            p.draw.rect(screen, color, p.Rect(x, y, SQ_SIZE, SQ_SIZE))
+            p.draw.rect(surface, color, p.Rect(x, y, SQ_SIZE, SQ_SIZE))
 
             if column == 0:
                 text_color = text_color_on_dark if color == dark_square else text_color_on_white
                 rank_text = font.render(str(8-row), True, text_color)
-                screen.blit(rank_text, (x+5, y+5))
+                surface.blit(rank_text, (x+5, y+5))
             
             if row == 7:
                 text_color = text_color_on_dark if color == dark_square else text_color_on_white
                 file_text = font.render(chr(97+column), True, text_color)
-                screen.blit(file_text, (x+SQ_SIZE - 10, y+SQ_SIZE - 20))
-
-def draw_pieces(screen, gs):
-
-    piece_mapping = {
-        (Color.WHITE, Piece.PAWN): 'wp',
-        (Color.WHITE, Piece.ROOK): 'wR',
-        (Color.WHITE, Piece.KNIGHT): 'wN',
-        (Color.WHITE, Piece.BISHOP): 'wB',
-        (Color.WHITE, Piece.QUEEN): 'wQ',
-        (Color.WHITE, Piece.KING): 'wK',
-        (Color.BLACK, Piece.PAWN): 'bp',
-        (Color.BLACK, Piece.ROOK): 'bR',
-        (Color.BLACK, Piece.KNIGHT): 'bN',
-        (Color.BLACK, Piece.BISHOP): 'bB',
-        (Color.BLACK, Piece.QUEEN): 'bQ',
-        (Color.BLACK, Piece.KING): 'bK',
-    }
-
-    for row in range(DIMENSION):
-        for column in range(DIMENSION):
-            square = row * 8 + column
-            square_mask = 1 << (63 - square)
-            for color in Color:
-                for piece_type in Piece:
-                    if gs.pieces[color][piece_type] & square_mask:
-                        piece_key = piece_mapping.get((color, piece_type))
-                        if piece_key in IMAGES:
-                            x = column * SQ_SIZE
-                            y = row * SQ_SIZE
-                            screen.blit(IMAGES[piece_key], p.Rect(x, y, SQ_SIZE, SQ_SIZE))
+                surface.blit(file_text, (x+SQ_SIZE - 10, y+SQ_SIZE - 20))
+    return surface
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
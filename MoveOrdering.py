@@ -0,0 +1,120 @@
+from Constants import Color, Piece, MoveFlag
+
+# Deepest ply the search reaches; the killer table has one slot per ply
+MAX_PLY = 100
+HASH_MOVE_SCORE = 1000000
+CAPTURE_SCORE = 100000
+PROMOTION_SCORE = 95000
+KILLER_SCORES = (90000, 85000)
+# History scores are halved once one of them passes this, which keeps quiet
+# moves ranked below killers and lets old statistics fade
+HISTORY_LIMIT = 50000
+
+
+class MoveOrderer:
+    def __init__(self, piece_values):
+        self.piece_values = piece_values
+        self.killers = [[None, None] for _ in range(MAX_PLY)]
+        # history[color][move & 4095], i.e. indexed by the from/to squares of the move code
+        self.history = [[0] * 4096 for _ in Color]
+        self.cutoffs = 0
+        self.first_move_cutoffs = 0
+
+    def new_search(self):
+        self.killers = [[None, None] for _ in range(MAX_PLY)]
+        self.age_history()
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.cutoffs = 0
+        self.first_move_cutoffs = 0
+
+    def age_history(self):
+        for color_history in self.history:
+            for i in range(4096):
+                color_history[i] >>= 1
+
+    def order_moves(self, gs, moves, ply, hash_move=None):
+        # Hash move, then captures by MVV-LVA, promotions, killers and finally
+        # quiet moves by history score
+        mailbox = gs.mailbox
+        values = self.piece_values
+        killers = self.killers[ply] if ply < MAX_PLY else (None, None)
+        history = self.history[gs.color]
+
+        def score(move):
+            if move == hash_move:
+                return HASH_MOVE_SCORE
+            flag = move >> 12
+            victim = Piece.PAWN if flag == MoveFlag.EN_PASSANT else mailbox[move >> 6 & 63]
+            if victim is not None:
+                return CAPTURE_SCORE + 10 * values[victim] - values[mailbox[move & 63]]
+            if flag == MoveFlag.PROMOTE_QUEEN:
+                return PROMOTION_SCORE
+            if move == killers[0]:
+                return KILLER_SCORES[0]
+            if move == killers[1]:
+                return KILLER_SCORES[1]
+            return history[move & 4095]
+
+        moves.sort(key=score, reverse=True)
+        return moves
+
+    def staged_moves(self, gs, ply, hash_move=None):
+        # Yields the legal moves of gs in the order of order_moves, but one stage
+        # at a time: the hash move, captures and promotions, killers, then quiet
+        # moves. A stage is generated only once the previous one is used up, so
+        # a cutoff on an early move saves generating the rest. Hash and killer
+        # moves come from other positions and are checked when they are reached.
+        if hash_move is not None:
+            if gs.is_legal(hash_move):
+                yield hash_move
+            else:
+                hash_move = None
+
+        for move in self.order_moves(gs, gs.get_capture_moves(), ply):
+            if move != hash_move:
+                yield move
+
+        mailbox = gs.mailbox
+        played_killers = []
+        if ply < MAX_PLY:
+            for killer in tuple(self.killers[ply]):
+                # a killer that captures here was already tried with the captures
+                if killer is None or killer == hash_move or mailbox[killer >> 6 & 63] is not None:
+                    continue
+                if gs.is_legal(killer):
+                    played_killers.append(killer)
+                    yield killer
+
+        for move in self.order_moves(gs, gs.get_quiet_moves(), ply):
+            if move != hash_move and move not in played_killers:
+                yield move
+
+    def record_cutoff(self, gs, move, ply, depth, move_index):
+        # Called after move caused a beta cutoff as the move_index-th move tried
+        self.cutoffs += 1
+        if move_index == 0:
+            self.first_move_cutoffs += 1
+        flag = move >> 12
+        if gs.mailbox[move >> 6 & 63] is not None or flag == MoveFlag.EN_PASSANT or flag >= MoveFlag.PROMOTE_KNIGHT:
+            return
+
+        if ply < MAX_PLY:
+            killers = self.killers[ply]
+            if killers[0] != move:
+                killers[1] = killers[0]
+                killers[0] = move
+
+        history = self.history[gs.color]
+        index = move & 4095
+        history[index] += depth * depth
+        if history[index] > HISTORY_LIMIT:
+            self.age_history()
+
+    def first_move_cutoff_rate(self):
+        return self.first_move_cutoffs / self.cutoffs if self.cutoffs else 0.0
+
+    def stats(self):
+        return {"cutoffs": self.cutoffs, "first_move_cutoffs": self.first_move_cutoffs,
+                "first_move_cutoff_rate": self.first_move_cutoff_rate()}
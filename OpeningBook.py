@@ -0,0 +1,157 @@
+import argparse
+import mmap
+import os
+import random
+import re
+import struct
+from ChessEngine import ChessBoard, Move, START_FEN
+
+# Book file: fixed-size records sorted by position key, each holding the zobrist
+# key of a position, a move code played from it and the move's weight. Several
+# records share a key when the book knows several moves for one position.
+RECORD = struct.Struct(">QHH")
+KEY = struct.Struct(">Q")
+MAX_WEIGHT = 0xFFFF
+# Weight a book move earns per game: a win for the side playing it counts twice a draw
+RESULT_POINTS = {"1-0": (2, 0), "0-1": (0, 2), "1/2-1/2": (1, 1)}
+DEFAULT_BOOK_PLIES = 16
+
+PGN_TAG = re.compile(r'\[(\w+)\s+"([^"]*)"\]')
+PGN_COMMENT = re.compile(r"\{[^}]*\}|;[^\n]*")
+PGN_MOVE_NUMBER = re.compile(r"^\d+\.+")
+
+
+class OpeningBook:
+    # Read-only view of a book file. The file is memory-mapped and binary
+    # searched, so opening a book costs nothing however large it is and only
+    # the pages a lookup touches are ever read.
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "rb")
+        size = os.fstat(self.file.fileno()).st_size
+        if size % RECORD.size:
+            raise ValueError(f"{path} is not a book file")
+        self.num_entries = size // RECORD.size
+        # an empty file cannot be mapped
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+    def close(self):
+        if self.num_entries:
+            self.data.close()
+        self.file.close()
+
+    def __len__(self):
+        return self.num_entries
+
+    def get_entries(self, key):
+        # (move code, weight) of every book move stored for key
+        low, high = 0, self.num_entries
+        while low < high:
+            middle = (low + high) // 2
+            if KEY.unpack_from(self.data, middle * RECORD.size)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+
+        entries = []
+        for index in range(low, self.num_entries):
+            entry_key, move, weight = RECORD.unpack_from(self.data, index * RECORD.size)
+            if entry_key != key:
+                break
+            entries.append((move, weight))
+        return entries
+
+    def choose_move(self, gs, rng=random):
+        # A legal book move for gs picked at random in proportion to the weights,
+        # or None when the position is not in the book
+        valid_moves = gs.generate_legal_moves()
+        entries = [(move, weight) for move, weight in self.get_entries(gs.zobrist_key)
+                   if weight and move in valid_moves]
+        if not entries:
+            return None
+        moves, weights = zip(*entries)
+        return rng.choices(moves, weights)[0]
+
+
+def read_pgn_games(path):
+    # Yields (start FEN, list of SAN moves, result) for every game of a PGN file
+    with open(path, encoding="utf-8", errors="replace") as f:
+        text = f.read()
+
+    for game in re.split(r"\n\s*\n(?=\[)", text):
+        tags = dict(PGN_TAG.findall(game))
+        movetext = PGN_COMMENT.sub(" ", PGN_TAG.sub(" ", game))
+        # variations may nest, so they are removed innermost first
+        while "(" in movetext:
+            stripped = re.sub(r"\([^()]*\)", " ", movetext)
+            if stripped == movetext:
+                break
+            movetext = stripped
+
+        moves = []
+        for token in movetext.split():
+            token = PGN_MOVE_NUMBER.sub("", token)
+            if not token or token.startswith("$") or token in ("1-0", "0-1", "1/2-1/2", "*"):
+                continue
+            moves.append(token)
+        if moves:
+            yield tags.get("FEN", START_FEN), moves, tags.get("Result", "*")
+
+
+def build_book(pgn_paths, book_path, max_plies=DEFAULT_BOOK_PLIES, min_games=1):
+    # Replays the first max_plies moves of every game and writes the moves seen,
+    # weighted by how well they scored, as a sorted book file. Moves played in
+    # fewer than min_games games are left out. Returns the number of records.
+    weights = {}
+    counts = {}
+    for pgn_path in pgn_paths:
+        for fen, moves, result in read_pgn_games(pgn_path):
+            try:
+                gs = ChessBoard.from_fen(fen)
+            except ValueError:
+                continue
+            points = RESULT_POINTS.get(result, (1, 1))
+            for san in moves[:max_plies]:
+                try:
+                    move = gs.parse_san(san)
+                except (ValueError, KeyError):
+                    break # the rest of an unreadable game is skipped
+                entry = (gs.zobrist_key, move)
+                weights[entry] = weights.get(entry, 0) + points[gs.color]
+                counts[entry] = counts.get(entry, 0) + 1
+                gs.make_move(move)
+
+    records = sorted(entry for entry, count in counts.items() if count >= min_games)
+    # weights are scaled down together so the largest fits its 16 bits
+    scale = max(1, -(-max((weights[entry] for entry in records), default=0) // MAX_WEIGHT))
+    with open(book_path, "wb") as f:
+        for key, move in records:
+            f.write(RECORD.pack(key, move, weights[(key, move)] // scale))
+    return len(records)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or query an opening book.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build = subparsers.add_parser("build", help="compile a book from PGN files")
+    build.add_argument("pgn", nargs="+")
+    build.add_argument("-o", "--output", default="book.bin")
+    build.add_argument("--plies", type=int, default=DEFAULT_BOOK_PLIES, help="moves per game taken into the book")
+    build.add_argument("--min-games", type=int, default=1, help="games a move needs to be kept")
+    probe = subparsers.add_parser("probe", help="list the book moves of a position")
+    probe.add_argument("book")
+    probe.add_argument("--fen", default=START_FEN)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        print(f"{build_book(args.pgn, args.output, args.plies, args.min_games)} records written to {args.output}")
+    else:
+        book = OpeningBook(args.book)
+        gs = ChessBoard.from_fen(args.fen)
+        for move, weight in sorted(book.get_entries(gs.zobrist_key), key=lambda entry: -entry[1]):
+            print(f"{gs.get_san(move)} ({Move.from_code(move).get_chess_notation()}): {weight}")
+        book.close()
+
+
+if __name__ == "__main__":
+    main()
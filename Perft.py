@@ -0,0 +1,97 @@
+import argparse
+import time
+from ChessEngine import ChessBoard, Move, START_FEN
+
+# Standard perft positions with their known leaf counts for depth 1, 2, ...
+REFERENCE_POSITIONS = [
+    ("start position", START_FEN,
+     [20, 400, 8902, 197281, 4865609]),
+    ("kiwipete", "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+     [48, 2039, 97862, 4085603]),
+    ("en passant and pins", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+     [14, 191, 2812, 43238, 674624]),
+    ("castling and promotions", "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+     [6, 264, 9467, 422333]),
+    ("promotion checks", "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+     [44, 1486, 62379, 2103487]),
+    ("middlegame", "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+     [46, 2079, 89890, 3894594]),
+    ("castling rights", "r3k2r/8/8/8/8/8/8/R3K2R w KQkq - 0 1",
+     [26, 568, 13744, 314346]),
+    ("underpromotions", "n1n5/PPPk4/8/8/8/8/4Kppp/5N1N b - - 0 1",
+     [24, 496, 9483, 182838]),
+]
+
+
+def perft(gs, depth):
+    # Number of leaf nodes of the legal move tree, depth plies deep
+    moves = gs.get_valid_moves()
+    if depth <= 1:
+        return len(moves) if depth == 1 else 1
+    nodes = 0
+    for move in moves:
+        gs.make_move(move)
+        nodes += perft(gs, depth - 1)
+        gs.undo_move()
+    return nodes
+
+
+def divide(gs, depth):
+    # Leaf counts below every root move, to find which move a wrong count hides under
+    counts = {}
+    for move in gs.get_valid_moves():
+        gs.make_move(move)
+        counts[Move.from_code(move).get_chess_notation()] = perft(gs, depth - 1)
+        gs.undo_move()
+    return counts
+
+
+def run_perft(fen, depth, show_divide=False):
+    gs = ChessBoard.from_fen(fen)
+    start_time = time.perf_counter()
+    if show_divide:
+        counts = divide(gs, depth)
+        for notation in sorted(counts):
+            print(f"{notation}: {counts[notation]}")
+        nodes = sum(counts.values())
+    else:
+        nodes = perft(gs, depth)
+    elapsed = time.perf_counter() - start_time
+    print(f"depth {depth}: {nodes} nodes in {elapsed:.2f}s ({int(nodes / elapsed) if elapsed else 0} nps)")
+    return nodes
+
+
+def run_suite(max_depth):
+    # Checks every reference position up to max_depth; returns True if all counts match
+    passed = True
+    total_nodes = 0
+    start_time = time.perf_counter()
+    for name, fen, counts in REFERENCE_POSITIONS:
+        gs = ChessBoard.from_fen(fen)
+        for depth, expected in enumerate(counts[:max_depth], 1):
+            nodes = perft(gs, depth)
+            total_nodes += nodes
+            result = "ok" if nodes == expected else f"FAILED (expected {expected})"
+            passed = passed and nodes == expected
+            print(f"{name}, depth {depth}: {nodes} {result}")
+    elapsed = time.perf_counter() - start_time
+    print(f"{total_nodes} nodes in {elapsed:.2f}s ({int(total_nodes / elapsed) if elapsed else 0} nps)")
+    return passed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Count leaf nodes of the legal move tree (perft).")
+    parser.add_argument("depth", type=int, nargs="?", default=3)
+    parser.add_argument("--fen", default=START_FEN, help="position to count from (default: start position)")
+    parser.add_argument("--divide", action="store_true", help="print the count below every root move")
+    parser.add_argument("--suite", action="store_true",
+                        help="check the reference positions up to depth and exit non-zero on a mismatch")
+    args = parser.parse_args()
+
+    if args.suite:
+        raise SystemExit(0 if run_suite(args.depth) else 1)
+    run_perft(args.fen, args.depth, args.divide)
+
+
+if __name__ == "__main__":
+    main()
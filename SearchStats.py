@@ -0,0 +1,61 @@
+import json
+import time
+
+
+class SearchProfiler:
+    # Splits the time of a search into move generation, evaluation and make/undo.
+    # It shadows the board's and finder's methods with instance attributes
+    # wrapping them for the length of one search, so a search run without a
+    # profiler calls the plain methods and pays nothing.
+    def __init__(self):
+        self.times = {"movegen": 0.0, "eval": 0.0, "make_undo": 0.0}
+        self.patched = []
+
+    def install(self, finder, gs):
+        self.wrap(gs, "get_valid_moves", "movegen")
+        self.wrap(gs, "get_capture_moves", "movegen")
+        self.wrap(gs, "get_quiet_moves", "movegen")
+        self.wrap(gs, "is_legal", "movegen")
+        self.wrap(gs, "make_move", "make_undo")
+        self.wrap(gs, "undo_move", "make_undo")
+        self.wrap(finder, "evaluate", "eval")
+
+    def wrap(self, obj, name, category):
+        method = getattr(obj, name)
+        times = self.times
+        perf_counter = time.perf_counter
+
+        def timed(*args):
+            start = perf_counter()
+            try:
+                return method(*args)
+            finally:
+                times[category] += perf_counter() - start
+
+        setattr(obj, name, timed)
+        self.patched.append((obj, name))
+
+    def uninstall(self):
+        # Deleting the instance attributes makes the class methods visible again
+        for obj, name in self.patched:
+            delattr(obj, name)
+        self.patched = []
+
+    def stats(self):
+        return {f"{category}_ms": int(seconds * 1000) for category, seconds in self.times.items()}
+
+
+class JsonLinesLog:
+    # Search listener writing one JSON object per line, e.g.
+    # finder.add_listener(JsonLinesLog("search.jsonl"))
+    def __init__(self, path, events=("done",)):
+        self.file = open(path, "a")
+        self.events = events
+
+    def __call__(self, event, info):
+        if event in self.events:
+            self.file.write(json.dumps({"event": event, "time": time.time(), **info}) + "\n")
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
@@ -0,0 +1,157 @@
+import argparse
+import datetime
+import json
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from ChessEngine import ChessBoard, START_FEN
+from Constants import Color
+from AIMoveFinder import AIMoveFinder
+from OpeningBook import OpeningBook
+from Tablebase import Tablebase
+
+# Games still running after this many plies are adjudicated as draws
+MAX_GAME_PLIES = 400
+
+
+def play_game(game_id, fen, time_limit_ms=None, max_nodes=None, max_depth=None, random_plies=0, seed=0,
+              tt_size_mb=16, max_plies=MAX_GAME_PLIES, book_path=None, tablebase_path=None):
+    # Plays one AIMoveFinder vs AIMoveFinder game from fen and returns its record.
+    # Each side has its own finder so their tables stay apart. The first
+    # random_plies moves are random, which spreads games from one opening.
+    rng = random.Random(seed * 1000003 + game_id)
+    gs = ChessBoard.from_fen(fen)
+    book = OpeningBook(book_path) if book_path else None
+    tablebase = Tablebase(tablebase_path) if tablebase_path else None
+    players = [AIMoveFinder(tt_size_mb, book=book, tablebase=tablebase, rng=rng),
+               AIMoveFinder(tt_size_mb, book=book, tablebase=tablebase, rng=rng)]
+    moves_san = []
+    nodes = 0
+    start_time = time.perf_counter()
+
+    while True:
+        valid_moves = gs.get_valid_moves()
+        if not valid_moves:
+            if gs.check:
+                result, termination = ("0-1" if gs.color == Color.WHITE else "1-0"), "checkmate"
+            else:
+                result, termination = "1/2-1/2", "stalemate"
+            break
+        if gs.is_repetition(2):
+            result, termination = "1/2-1/2", "threefold repetition"
+            break
+        if gs.is_fifty_move_draw():
+            result, termination = "1/2-1/2", "fifty-move rule"
+            break
+        if len(gs.move_log) >= max_plies:
+            result, termination = "1/2-1/2", "move limit"
+            break
+
+        if len(gs.move_log) < random_plies:
+            move = rng.choice(valid_moves)
+        else:
+            player = players[gs.color]
+            move = player.find_best_move(gs, valid_moves, time_limit_ms, max_nodes, max_depth)
+            nodes += player.search_info["nodes"]
+        moves_san.append(gs.get_san(move))
+        gs.make_move(move)
+
+    if book is not None:
+        book.close()
+    return {"game": game_id, "fen": fen, "result": result, "termination": termination,
+            "plies": len(moves_san), "nodes": nodes, "time_ms": int((time.perf_counter() - start_time) * 1000),
+            "moves": moves_san}
+
+
+def to_pgn(game, event="ChessBite self-play"):
+    headers = [("Event", event), ("Site", "?"), ("Date", datetime.date.today().strftime("%Y.%m.%d")),
+               ("Round", str(game["game"] + 1)), ("White", "ChessBite"), ("Black", "ChessBite"),
+               ("Result", game["result"])]
+    if game["fen"] != START_FEN:
+        headers += [("SetUp", "1"), ("FEN", game["fen"])]
+    headers.append(("Termination", game["termination"]))
+
+    start = ChessBoard.from_fen(game["fen"])
+    move_number = start.first_move_number
+    tokens = []
+    for i, san in enumerate(game["moves"]):
+        color = start.color ^ (i & 1)
+        if color == Color.WHITE:
+            tokens.append(f"{move_number}.")
+        elif i == 0:
+            tokens.append(f"{move_number}...")
+        if color == Color.BLACK:
+            move_number += 1
+        tokens.append(san)
+    tokens.append(game["result"])
+
+    lines = [f'[{name} "{value}"]' for name, value in headers] + [""]
+    line = ""
+    for token in tokens:
+        if len(line) + len(token) + 1 > 80:
+            lines.append(line)
+            line = token
+        else:
+            line = f"{line} {token}" if line else token
+    lines.append(line)
+    return "\n".join(lines) + "\n\n"
+
+
+def load_openings(path):
+    # One FEN per line; blank lines and lines starting with # are skipped
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+
+def run_games(num_games, openings, pgn_path, results_path, workers=None, **game_options):
+    # Plays the games in a process pool and appends every finished game to the
+    # PGN and JSON-lines files as soon as it comes back. Returns the score counts.
+    counts = {"1-0": 0, "0-1": 0, "1/2-1/2": 0}
+    start_time = time.perf_counter()
+    with ProcessPoolExecutor(workers or os.cpu_count()) as executor, \
+            open(pgn_path, "a") as pgn_file, open(results_path, "a") as results_file:
+        futures = [executor.submit(play_game, game_id, openings[game_id % len(openings)], **game_options)
+                   for game_id in range(num_games)]
+        for future in as_completed(futures):
+            game = future.result()
+            pgn_file.write(to_pgn(game))
+            pgn_file.flush()
+            results_file.write(json.dumps(game) + "\n")
+            results_file.flush()
+            counts[game["result"]] += 1
+            finished = sum(counts.values())
+            print(f"{finished}/{num_games} games, +{counts['1-0']} ={counts['1/2-1/2']} -{counts['0-1']}"
+                  f" ({time.perf_counter() - start_time:.0f}s)")
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Play AIMoveFinder against itself without the UI.")
+    parser.add_argument("games", type=int, nargs="?", default=100)
+    parser.add_argument("--movetime", type=int, help="search time per move in milliseconds")
+    parser.add_argument("--nodes", type=int, help="node budget per move")
+    parser.add_argument("--depth", type=int, help="fixed search depth per move")
+    parser.add_argument("--openings", help="file with one starting FEN per line (default: start position)")
+    parser.add_argument("--random-plies", type=int, default=0, help="random moves played at the start of each game")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-plies", type=int, default=MAX_GAME_PLIES)
+    parser.add_argument("--workers", type=int, help="parallel games (default: one per CPU)")
+    parser.add_argument("--book", help="opening book file both players use")
+    parser.add_argument("--tablebases", help="directory of endgame tables both players use")
+    parser.add_argument("--hash", type=int, default=16, help="transposition table size per player in MB")
+    parser.add_argument("--pgn", default="selfplay.pgn")
+    parser.add_argument("--results", default="selfplay.jsonl")
+    args = parser.parse_args()
+
+    openings = load_openings(args.openings) if args.openings else [START_FEN]
+    if args.movetime is None and args.nodes is None and args.depth is None:
+        args.movetime = 100
+    run_games(args.games, openings, args.pgn, args.results, args.workers, time_limit_ms=args.movetime,
+              max_nodes=args.nodes, max_depth=args.depth, random_plies=args.random_plies, seed=args.seed,
+              tt_size_mb=args.hash, max_plies=args.max_plies, book_path=args.book,
+              tablebase_path=args.tablebases)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,488 @@
+import argparse
+import itertools
+import os
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from Bitboards import SQUARE_BB, KING_ATTACKS, KNIGHT_ATTACKS, PAWN_ATTACKS, PAWN_PUSH, PAWN_DOUBLE_PUSH_ROW_BB, \
+    PROMOTION_ROW_BB, rook_attacks, bishop_attacks, queen_attacks, popcount
+from Constants import Color, Piece
+
+# Endgame tables for endings of up to MAX_PIECES pieces, solved by retrograde
+# analysis. En passant is left out: positions where it is possible are not
+# probed, and double pushes do not give the chance to take en passant. A table holds one signed byte per position and side to
+# move: 0 is a draw, p > 0 means the side to move mates in p plies and -(p + 1)
+# that it is mated in p plies.
+MAX_PIECES = 4
+# Longest mate a signed byte can hold
+MAX_TABLE_PLIES = 127
+TABLE_EXTENSION = ".tb"
+PIECE_LETTERS = {Piece.QUEEN: "Q", Piece.ROOK: "R", Piece.BISHOP: "B", Piece.KNIGHT: "N", Piece.PAWN: "P"}
+LETTER_PIECES = {letter: piece for piece, letter in PIECE_LETTERS.items()}
+PROMOTION_PIECES = (Piece.QUEEN, Piece.ROOK, Piece.BISHOP, Piece.KNIGHT)
+# Pawns never stand on the first or last rank
+PAWN_FREE_BB = PROMOTION_ROW_BB[0] | PROMOTION_ROW_BB[1]
+# Ranges of positions each worker process gets in the first pass of solve()
+SCAN_RANGES_PER_WORKER = 8
+
+
+def _transform(sq, t):
+    # One of the 8 symmetries of the board: bit 0 mirrors the files, bit 1 the
+    # ranks and bit 2 swaps ranks and files
+    row, col = sq >> 3, sq & 7
+    if t & 1:
+        col = 7 - col
+    if t & 2:
+        row = 7 - row
+    if t & 4:
+        row, col = col, row
+    return row * 8 + col
+
+
+TRANSFORMS = [[_transform(sq, t) for sq in range(64)] for t in range(8)]
+# The strong king is always moved into the triangle a1-d1-d4 (rank <= file <= d)
+TRIANGLE = [sq for sq in range(64) if 7 - (sq >> 3) <= (sq & 7) <= 3]
+TRIANGLE_INDEX = {sq: i for i, sq in enumerate(TRIANGLE)}
+# Symmetries taking each square into the triangle; two of them for squares on its diagonal
+KING_TRANSFORMS = [[t for t in range(8) if TRANSFORMS[t][sq] in TRIANGLE_INDEX] for sq in range(64)]
+# Pawns only allow mirroring the files, so with pawns the strong king is kept on files a-d
+HALF = [sq for sq in range(64) if sq & 7 <= 3]
+HALF_INDEX = {sq: i for i, sq in enumerate(HALF)}
+HALF_TRANSFORMS = [[0] if sq & 7 <= 3 else [1] for sq in range(64)]
+
+
+def piece_attacks(piece, sq, occupied, color=Color.WHITE):
+    if piece == Piece.PAWN:
+        return PAWN_ATTACKS[color][sq]
+    if piece == Piece.KNIGHT:
+        return KNIGHT_ATTACKS[sq]
+    if piece == Piece.BISHOP:
+        return bishop_attacks(sq, occupied)
+    if piece == Piece.ROOK:
+        return rook_attacks(sq, occupied)
+    if piece == Piece.QUEEN:
+        return queen_attacks(sq, occupied)
+    return KING_ATTACKS[sq]
+
+
+def table_name(pieces):
+    # Name of the table holding a set of (color, piece) and whether its colors
+    # are swapped, as tables always give the stronger side the white pieces
+    white = sorted((piece for color, piece in pieces if color == Color.WHITE and piece != Piece.KING), reverse=True)
+    black = sorted((piece for color, piece in pieces if color == Color.BLACK and piece != Piece.KING), reverse=True)
+    flip = (len(black), black) > (len(white), white)
+    if flip:
+        white, black = black, white
+    name = "K" + "".join(PIECE_LETTERS[piece] for piece in white) + "vK" + "".join(PIECE_LETTERS[piece] for piece in black)
+    return name, flip
+
+
+class EndgameTable:
+    def __init__(self, name, values=None):
+        self.name = name
+        strong, weak = name.split("v")
+        extras = [(Color.WHITE, LETTER_PIECES[letter]) for letter in strong[1:]]
+        extras += [(Color.BLACK, LETTER_PIECES[letter]) for letter in weak[1:]]
+        # Slots of the index: strong king, weak king, then the other pieces
+        self.colors = [Color.WHITE, Color.BLACK] + [color for color, _ in extras]
+        self.types = [Piece.KING, Piece.KING] + [piece for _, piece in extras]
+        if Piece.PAWN in self.types:
+            self.king_squares, self.king_index, self.king_transforms = HALF, HALF_INDEX, HALF_TRANSFORMS
+        else:
+            self.king_squares, self.king_index, self.king_transforms = TRIANGLE, TRIANGLE_INDEX, KING_TRANSFORMS
+        self.size = len(self.king_squares) * 64 ** (len(self.types) - 1) * 2
+        # Runs of interchangeable pieces (e.g. two white rooks), whose squares are kept sorted
+        self.groups = []
+        start = 2
+        for _, run in itertools.groupby(zip(self.colors[2:], self.types[2:])):
+            end = start + len(list(run))
+            if end - start > 1:
+                self.groups.append((start, end))
+            start = end
+        self.values = values
+
+    def canonical(self, squares):
+        # The symmetric copy of squares the index stores: strong king in the
+        # triangle (or on files a-d with pawns), ties broken by the smallest square tuple
+        best = None
+        for t in self.king_transforms[squares[0]]:
+            transform = TRANSFORMS[t]
+            candidate = [transform[sq] for sq in squares]
+            for start, end in self.groups:
+                candidate[start:end] = sorted(candidate[start:end])
+            if best is None or candidate < best:
+                best = candidate
+        return best
+
+    def index(self, squares, color):
+        squares = self.canonical(squares)
+        index = self.king_index[squares[0]]
+        for sq in squares[1:]:
+            index = index * 64 + sq
+        return index * 2 + color
+
+    def decode(self, index):
+        color = index & 1
+        index >>= 1
+        squares = []
+        for _ in range(len(self.types) - 1):
+            squares.append(index & 63)
+            index >>= 6
+        squares.append(self.king_squares[index])
+        squares.reverse()
+        return squares, color
+
+    def probe(self, squares, color):
+        return self.values[self.index(squares, color)]
+
+
+class Tablebase:
+    # Loads tables from directory on first use; probe() gives the value of a
+    # ChessBoard position, or None when no table covers it
+    def __init__(self, directory="tablebases"):
+        self.directory = directory
+        self.tables = {}
+
+    def get_table(self, name):
+        if name not in self.tables:
+            path = os.path.join(self.directory, name + TABLE_EXTENSION)
+            table = None
+            if os.path.exists(path):
+                table = EndgameTable(name)
+                table.values = array("b")
+                with open(path, "rb") as f:
+                    table.values.frombytes(f.read())
+            self.tables[name] = table
+        return self.tables[name]
+
+    def probe(self, gs):
+        if gs.castling or popcount(gs.board) > MAX_PIECES:
+            return None
+        if gs.en_passant_possible:
+            row, col = gs.en_passant_possible
+            # the tables do not know about en passant captures
+            if PAWN_ATTACKS[gs.color ^ 1][row * 8 + col] & gs.pieces[gs.color][Piece.PAWN]:
+                return None
+        pieces = []
+        for color in Color:
+            for piece in Piece:
+                bb = gs.pieces[color][piece]
+                while bb:
+                    sq = 64 - bb.bit_length()
+                    bb ^= SQUARE_BB[sq]
+                    pieces.append((color, piece, sq))
+        return self.probe_pieces(pieces, gs.color)
+
+    def probe_pieces(self, pieces, color):
+        # pieces is a list of (color, piece, square)
+        name, flip = table_name([(piece_color, piece) for piece_color, piece, _ in pieces])
+        if name == "KvK":
+            return 0
+        table = self.get_table(name)
+        if table is None:
+            return None
+        if flip:
+            # swap the colors and mirror the ranks
+            pieces = [(piece_color ^ 1, piece, sq ^ 56) for piece_color, piece, sq in pieces]
+            color ^= 1
+        remaining = sorted(pieces, key=lambda p: (p[1] != Piece.KING, p[0], -p[1]))
+        return table.probe([sq for _, _, sq in remaining], color)
+
+    def best_move(self, gs):
+        # The legal move keeping the best table value: the fastest mate when
+        # winning, the slowest when losing. None if gs is not covered.
+        if self.probe(gs) is None:
+            return None
+        best_move, best_key = None, None
+        for move in gs.get_valid_moves():
+            gs.make_move(move)
+            value = self.probe(gs)
+            gs.undo_move()
+            if value is None:
+                return None
+            # rank the moves by the value they leave to the opponent
+            if value < 0:
+                key = (2, -(-value - 1)) # opponent mated: sooner is better
+            elif value == 0:
+                key = (1, 0)
+            else:
+                key = (0, value) # opponent mates: later is better
+            if best_key is None or key > best_key:
+                best_move, best_key = move, key
+        return best_move
+
+    def generate(self, name, verbose=True, workers=1):
+        # Solves a table, and first every other table a capture or promotion
+        # can lead to, then writes it to directory
+        strong, weak = name.split("v")
+        pieces = [(Color.WHITE, LETTER_PIECES[letter]) for letter in strong[1:]]
+        pieces += [(Color.BLACK, LETTER_PIECES[letter]) for letter in weak[1:]]
+        sub_names = set()
+        for i, (color, piece) in enumerate(pieces):
+            sub_names.add(table_name(pieces[:i] + pieces[i + 1:])[0])
+            if piece != Piece.PAWN:
+                continue
+            for promoted in PROMOTION_PIECES:
+                promoted_pieces = pieces[:i] + [(color, promoted)] + pieces[i + 1:]
+                sub_names.add(table_name(promoted_pieces)[0])
+                # promoting with a capture
+                for j, (other_color, _) in enumerate(promoted_pieces):
+                    if other_color != color:
+                        sub_names.add(table_name(promoted_pieces[:j] + promoted_pieces[j + 1:])[0])
+        for sub_name in sorted(sub_names):
+            if sub_name != "KvK" and self.get_table(sub_name) is None:
+                self.generate(sub_name, verbose, workers)
+
+        table = EndgameTable(name)
+        table.values = solve(table, self, workers)
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, name + TABLE_EXTENSION), "wb") as f:
+            f.write(table.values.tobytes())
+        self.tables[name] = table
+        if verbose:
+            print(f"{name}: {table.size} positions, longest mate {max(table.values)} plies")
+        return table
+
+
+def scan_positions(table, tablebase, start, end):
+    # First pass of solve() over the indices start..end-1, which looks at each
+    # position on its own. Returns the counts, slowest losses and solved flags
+    # of the range, the positions solved right away as (index, value, plies)
+    # and the capture or promotion wins as (plies, index).
+    types = table.types
+    colors = table.colors
+    num_pieces = len(types)
+    pawns = [i for i in range(num_pieces) if types[i] == Piece.PAWN]
+    counts = array("b", [-1]) * (end - start) # -1 marks illegal and duplicate positions
+    slowest = array("B", [0]) * (end - start)
+    solved = bytearray(end - start)
+    mates = []
+    capture_wins = []
+
+    def attacked(sq, by_color, squares, occupied, skip=-1):
+        for i in range(num_pieces):
+            if colors[i] == by_color and i != skip \
+                    and piece_attacks(types[i], squares[i], occupied, by_color) & SQUARE_BB[sq]:
+                return True
+        return False
+
+    for index in range(start, end):
+        squares, color = table.decode(index)
+        if len(set(squares)) < num_pieces or KING_ATTACKS[squares[0]] & SQUARE_BB[squares[1]]:
+            continue
+        if any(SQUARE_BB[squares[i]] & PAWN_FREE_BB for i in pawns):
+            continue
+        if table.index(squares, color) != index:
+            continue
+        occupied = 0
+        own = 0
+        for i, sq in enumerate(squares):
+            occupied |= SQUARE_BB[sq]
+            if colors[i] == color:
+                own |= SQUARE_BB[sq]
+        king = squares[color]
+        if attacked(squares[color ^ 1], color, squares, occupied):
+            continue
+
+        children = set()
+        legal_moves = 0
+        best_win = None
+        escape = False
+        worst_loss = 0
+        for i in range(num_pieces):
+            if colors[i] != color:
+                continue
+            from_sq = squares[i]
+            if types[i] == Piece.PAWN:
+                targets = PAWN_ATTACKS[color][from_sq] & occupied & ~own
+                push = from_sq + PAWN_PUSH[color]
+                if not occupied & SQUARE_BB[push]:
+                    targets |= SQUARE_BB[push]
+                    if PAWN_DOUBLE_PUSH_ROW_BB[color] & SQUARE_BB[push] \
+                            and not occupied & SQUARE_BB[push + PAWN_PUSH[color]]:
+                        targets |= SQUARE_BB[push + PAWN_PUSH[color]]
+            else:
+                targets = piece_attacks(types[i], from_sq, occupied) & ~own
+            while targets:
+                to_sq = 64 - targets.bit_length()
+                targets ^= SQUARE_BB[to_sq]
+                captured = next((j for j in range(num_pieces) if squares[j] == to_sq), None)
+                new_squares = list(squares)
+                new_squares[i] = to_sq
+                new_occupied = occupied ^ SQUARE_BB[from_sq] | SQUARE_BB[to_sq]
+                king_sq = to_sq if i == color else king
+                if attacked(king_sq, color ^ 1, new_squares, new_occupied, captured if captured is not None else -1):
+                    continue
+                promotion = types[i] == Piece.PAWN and PROMOTION_ROW_BB[color] & SQUARE_BB[to_sq]
+                if captured is None and not promotion:
+                    legal_moves += 1
+                    children.add(table.index(new_squares, color ^ 1))
+                    continue
+                # the move leaves the table; each promotion piece is a move of its own
+                for piece in PROMOTION_PIECES if promotion else (types[i],):
+                    legal_moves += 1
+                    remaining = [(colors[j], piece if j == i else types[j], new_squares[j])
+                                 for j in range(num_pieces) if j != captured]
+                    value = tablebase.probe_pieces(remaining, color ^ 1)
+                    if value < 0:
+                        best_win = min(best_win, -value) if best_win is not None else -value
+                    elif value > 0:
+                        worst_loss = max(worst_loss, value)
+                    else:
+                        escape = True
+
+        offset = index - start
+        if legal_moves == 0:
+            if attacked(king, color ^ 1, squares, occupied):
+                mates.append((index, -1, 0)) # checkmated
+            else:
+                solved[offset] = 1 # stalemate
+            counts[offset] = 0
+            continue
+        # a winning or drawing capture means the position can never be lost
+        counts[offset] = len(children) + (1 if escape or best_win is not None else 0)
+        slowest[offset] = worst_loss
+        if best_win is not None:
+            capture_wins.append((best_win, index))
+        elif counts[offset] == 0:
+            mates.append((index, -(worst_loss + 2), worst_loss + 1))
+    return counts, slowest, solved, mates, capture_wins
+
+
+def solve(table, tablebase, workers=1):
+    # Retrograde analysis. Every legal position first gets the number of
+    # distinct positions its quiet moves lead to; captures and promotions are
+    # looked up in the other tables right away. Mates then spread backwards one
+    # ply at a time: a position with a move into a lost position is won one ply
+    # later, and a position whose moves all lead to won positions is lost once
+    # its count runs out, one ply after its slowest loss.
+    size = table.size
+    types = table.types
+    colors = table.colors
+    num_pieces = len(types)
+    values = array("b", [0]) * size
+    counts = array("b", [-1]) * size
+    slowest = array("B", [0]) * size
+    solved = bytearray(size)
+    frontier = {} # plies -> positions solved at that distance, to spread from
+    capture_wins = {} # plies -> positions winning by a capture or promotion in that many plies
+
+    def set_value(index, value, plies):
+        values[index] = value
+        solved[index] = 1
+        frontier.setdefault(plies, []).append(index)
+
+    # The first pass is split into ranges, which worker processes scan in parallel
+    step = -(-size // (workers * SCAN_RANGES_PER_WORKER))
+    starts = range(0, size, step)
+    ends = [min(start + step, size) for start in starts]
+    if workers > 1:
+        executor = ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(tablebase.directory,))
+        with executor:
+            parts = list(executor.map(_scan_positions, itertools.repeat(table.name), starts, ends))
+    else:
+        parts = [scan_positions(table, tablebase, start, end) for start, end in zip(starts, ends)]
+    for start, end, (part_counts, part_slowest, part_solved, mates, part_wins) in zip(starts, ends, parts):
+        counts[start:end] = part_counts
+        slowest[start:end] = part_slowest
+        solved[start:end] = part_solved
+        for index, value, plies in mates:
+            set_value(index, value, plies)
+        for plies, index in part_wins:
+            capture_wins.setdefault(plies, []).append(index)
+
+    plies = 0
+    while plies <= max(list(frontier) + list(capture_wins), default=-1):
+        for index in capture_wins.get(plies, []):
+            if not solved[index]:
+                set_value(index, plies, plies)
+        for index in frontier.pop(plies, []):
+            squares, color = table.decode(index)
+            lost = values[index] < 0
+            occupied = 0
+            for sq in squares:
+                occupied |= SQUARE_BB[sq]
+            # positions one move earlier: a piece of the other side steps back
+            predecessors = set()
+            for i in range(num_pieces):
+                if colors[i] == color:
+                    continue
+                if types[i] == Piece.PAWN:
+                    # undo a single push, or a double push from the second rank
+                    push = PAWN_PUSH[color ^ 1]
+                    origins = SQUARE_BB[squares[i] - push] & ~occupied
+                    if origins & PAWN_DOUBLE_PUSH_ROW_BB[color ^ 1]:
+                        origins |= SQUARE_BB[squares[i] - 2 * push] & ~occupied
+                else:
+                    origins = piece_attacks(types[i], squares[i], occupied) & ~occupied
+                while origins:
+                    sq = 64 - origins.bit_length()
+                    origins ^= SQUARE_BB[sq]
+                    new_squares = list(squares)
+                    new_squares[i] = sq
+                    predecessors.add(table.index(new_squares, color ^ 1))
+            for predecessor in predecessors:
+                if counts[predecessor] < 0 or solved[predecessor]:
+                    continue
+                if lost:
+                    set_value(predecessor, plies + 1, plies + 1)
+                else:
+                    counts[predecessor] -= 1
+                    slowest[predecessor] = max(slowest[predecessor], plies)
+                    if counts[predecessor] == 0:
+                        set_value(predecessor, -(slowest[predecessor] + 2), slowest[predecessor] + 1)
+        plies += 1
+    return values
+
+
+# Tables of a worker process of solve(), loaded from disk once per process
+_worker_tablebase = None
+
+
+def _init_worker(directory):
+    global _worker_tablebase
+    _worker_tablebase = Tablebase(directory)
+
+
+def _scan_positions(name, start, end):
+    return scan_positions(EndgameTable(name), _worker_tablebase, start, end)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate or probe endgame tables.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    generate = subparsers.add_parser("generate", help="solve tables, e.g. KQvK KPvK KQvKR",
+                                     description="Solve tables along with the smaller tables they lead to. A 3-piece "
+                                                 "table takes under a minute, a 4-piece one 10-15 minutes of CPU time, "
+                                                 "and a 4-piece table with all its smaller tables can take hours; "
+                                                 "--workers spreads most of that over several processes.")
+    generate.add_argument("tables", nargs="+")
+    generate.add_argument("--directory", default="tablebases")
+    generate.add_argument("--workers", type=int, default=1, help="processes sharing the first pass over the positions")
+    probe = subparsers.add_parser("probe", help="look up a position")
+    probe.add_argument("fen")
+    probe.add_argument("--directory", default="tablebases")
+    args = parser.parse_args()
+
+    tablebase = Tablebase(args.directory)
+    if args.command == "generate":
+        for name in args.tables:
+            tablebase.generate(name, workers=args.workers)
+    else:
+        from ChessEngine import ChessBoard
+        gs = ChessBoard.from_fen(args.fen)
+        value = tablebase.probe(gs)
+        if value is None:
+            print("not in the tablebase")
+        elif value == 0:
+            print("draw")
+        elif value > 0:
+            print(f"side to move mates in {value} plies")
+        else:
+            print(f"side to move is mated in {-value - 1} plies")
+        move = tablebase.best_move(gs)
+        if move is not None:
+            print(f"best move: {gs.get_san(move)}")
+
+
+if __name__ == "__main__":
+    main()
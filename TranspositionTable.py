@@ -0,0 +1,72 @@
+from array import array
+
+ENTRY_BYTES = 16 # 8 bytes of key + 8 bytes of packed data
+BUCKET_SIZE = 2 # slot 0 is depth-preferred, slot 1 is always-replace
+
+# Packed data layout: move in the low 24 bits, score (offset to be unsigned) in
+# the next 32, then 6 bits of depth and 2 bits of bound
+MOVE_MASK = (1 << 24) - 1
+SCORE_SHIFT = 24
+SCORE_OFFSET = 1 << 31
+DEPTH_SHIFT = 56
+MAX_DEPTH = (1 << 6) - 1
+BOUND_SHIFT = 62
+
+
+class TranspositionTable:
+    def __init__(self, size_mb=16):
+        self.size_mb = size_mb
+        self.num_buckets = max(1, int(size_mb * 1024 * 1024) // (ENTRY_BYTES * BUCKET_SIZE))
+        self.keys = array('Q', [0]) * (self.num_buckets * BUCKET_SIZE)
+        self.data = array('Q', [0]) * (self.num_buckets * BUCKET_SIZE)
+        self.hits = 0
+        self.misses = 0
+        self.collisions = 0
+
+    def clear(self):
+        self.keys = array('Q', [0]) * (self.num_buckets * BUCKET_SIZE)
+        self.data = array('Q', [0]) * (self.num_buckets * BUCKET_SIZE)
+        self.hits = 0
+        self.misses = 0
+        self.collisions = 0
+
+    def probe(self, key):
+        # Returns (depth, score, bound, move) stored for key, or None
+        index = (key % self.num_buckets) * BUCKET_SIZE
+        keys = self.keys
+        if keys[index] == key:
+            data = self.data[index]
+        elif keys[index + 1] == key:
+            data = self.data[index + 1]
+        else:
+            self.misses += 1
+            if self.data[index]:
+                self.collisions += 1
+            return None
+        self.hits += 1
+        return ((data >> DEPTH_SHIFT) & MAX_DEPTH,
+                ((data >> SCORE_SHIFT) & 0xFFFFFFFF) - SCORE_OFFSET,
+                data >> BOUND_SHIFT,
+                (data & MOVE_MASK) or None)
+
+    def store(self, key, depth, score, bound, move=None):
+        index = (key % self.num_buckets) * BUCKET_SIZE
+        depth = min(depth, MAX_DEPTH)
+        data = ((bound << BOUND_SHIFT) | (depth << DEPTH_SHIFT)
+                | ((score + SCORE_OFFSET) << SCORE_SHIFT) | (move or 0))
+        # Deep entries stay in the first slot until something at least as
+        # deep (or the same position) comes along; the rest go to the second
+        if self.keys[index] == key or depth >= (self.data[index] >> DEPTH_SHIFT) & MAX_DEPTH or not self.data[index]:
+            self.keys[index] = key
+            self.data[index] = data
+        else:
+            self.keys[index + 1] = key
+            self.data[index + 1] = data
+
+    def hit_rate(self):
+        probes = self.hits + self.misses
+        return self.hits / probes if probes else 0.0
+
+    def stats(self):
+        return {"size_mb": self.size_mb, "entries": len(self.keys), "hits": self.hits,
+                "misses": self.misses, "collisions": self.collisions, "hit_rate": self.hit_rate()}
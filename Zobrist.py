@@ -0,0 +1,28 @@
+import random
+from Constants import Color, Piece
+
+# Keys come from a fixed seed so that a position hashes the same in every
+# process and every run (worker processes, stored tables and books rely on it)
+_random = random.Random(0x2F3A9C51)
+
+PIECE_KEYS = [[[_random.getrandbits(64) for sq in range(64)] for piece_type in Piece] for color in Color]
+BLACK_TO_MOVE_KEY = _random.getrandbits(64)
+CASTLING_KEYS = [_random.getrandbits(64) for rights in range(16)]
+EN_PASSANT_KEYS = [_random.getrandbits(64) for col in range(8)]
+
+
+def compute_hash(gs):
+    key = 0
+    for color in Color:
+        for piece_type in Piece:
+            current_pieces = gs.pieces[color][piece_type]
+            while current_pieces:
+                sq = 64 - current_pieces.bit_length()
+                current_pieces ^= 1 << (63 - sq)
+                key ^= PIECE_KEYS[color][piece_type][sq]
+    if gs.color == Color.BLACK:
+        key ^= BLACK_TO_MOVE_KEY
+    key ^= CASTLING_KEYS[gs.castling]
+    if gs.en_passant_possible:
+        key ^= EN_PASSANT_KEYS[gs.en_passant_possible[1]]
+    return key